@@ -17,7 +17,6 @@
 import httplib
 import base64
 import sys
-import xml.dom.minidom as minidom
 import time
 import logging
 
@@ -77,7 +76,7 @@ class VRAConfigSettor:
 
     masterout = ""
 
-    def _init_(self):
+    def __init__(self):
         self.vra_host_name= ""
         self.vra_root_password = ""
         self.vra_host_port=""
@@ -87,6 +86,9 @@ class VRAConfigSettor:
         self.vra_ssl_country=""
         self.vra_ntp_server = ""
 
+        # parsed config-page queries by requestid, cleared on every submit
+        self.configPageValues = {}
+
     def initializeHost(self, hostname, password, vra_host_port):
         self.vra_host_name= hostname
         self.vra_root_password = password
@@ -100,25 +102,11 @@ class VRAConfigSettor:
     def initializeNTPSettings(self,vra_ntp_server):
         self.vra_ntp_server=vra_ntp_server
 
-    #todo pass in id and thus make this method generic
-    def parseResponseToSeeIfHostSettingsArePresent(self, xmlResponse):
-
-        #iterate lines
-        xmldoc = minidom.parseString(xmlResponse)
-        itemlist = xmldoc.getElementsByTagName('value')
+    def checkHostSettingsArePresent(self, values):
 
         hostSettingFound=False
         sslSettingsFound=False
-        for s in itemlist:
-            id = ""
-            value = ""
-            id=s.attributes['id'].value
-
-
-            childNodes=s.childNodes
-            if( (childNodes is not None) and (len(childNodes) !=0) ):
-                value=s.childNodes[0].data
-                value = value[0:20]
+        for id, value in values.items():
 
             if("cafe.host" in id) and (value != ""):
                 logging.debug("vra host setting found")
@@ -138,64 +126,45 @@ class VRAConfigSettor:
 
         return True
 
-
-    #todo pass in id and thus make this method generic
-    def parseResponseToGetValue(self, xmlResponse, idkey):
-
-        #iterate lines
-        xmldoc = minidom.parseString(xmlResponse)
-        itemlist = xmldoc.getElementsByTagName('value')
-
-        found_value=None
-        for s in itemlist:
-            id = ""
-            value = ""
-            id=s.attributes['id'].value
-
-
-            childNodes=s.childNodes
-            if( (childNodes is not None) and (len(childNodes) !=0) ):
-                value=s.childNodes[0].data
-                value = value[0:20]
-
-            if(idkey in id):
-                found_value=value
-
-        if(found_value is not None):
-            return found_value
-
-        logging.debug("Parsed value for id from xml is None")
-        return None
-
+    def getConfigPageValues(self, vRAInstance, token, requestid):
+        """
+        Return the id to value dict of a config-page query, fetched and parsed
+        once per requestid until a submit invalidates it. None when the query
+        fails.
+        """
+        if requestid not in self.configPageValues:
+            xmlResponse = self.getXMLForConfigPage(vRAInstance, token, requestid,
+                                                   CONFIG_PAGE_READ_ACTIONS.get(requestid, "query"))
+            if(xmlResponse is None):
+                return None
+            logging.debug(xmlResponse)
+            self.configPageValues[requestid] = parse_config_page(xmlResponse)[1]
+
+        return self.configPageValues[requestid]
 
     def getvRA(self, vRAInstance):
-        conn = httplib.HTTPSConnection(vRAInstance, 5480)
         headers = {"Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8", "Cache-Control": "no-cache"}
         try:
-            conn.request('GET', "/#core.Login", "", headers)
-            response = conn.getresponse()
-            conn.close()
+            status, reason, body = vami_pool.request(vRAInstance, 5480, 'GET', "/#core.Login", "", headers)
         except Exception as e:
             self.addToResultMessage("Error connecting to vra instance")
             return False
 
-        return (response.status == 200) and (response.reason == 'OK')
+        return (status == 200) and (reason == 'OK')
 
     def getvRAAuthToken(self, vRAInstance, vRARootPassword):
         logging.debug("Obtaining auth token")
         token = None
-        conn = httplib.HTTPSConnection(vRAInstance, 5480)
         credentialString = "root:"  + vRARootPassword
         credentialStringBytes = credentialString.encode()
         encodedCreds = base64.encodestring(credentialStringBytes).decode().replace('\n','')
         headers = {"Authorization": "Basic " + encodedCreds, "Accept": "text/html, text/xml, application/xml", "Cache-Control": "no-cache", "Accept-Encoding": "gzip, deflate", "Accept-Language": "en-US,en;q=0.8,pt;q=0.6", "Connection":"keep-alive", "Content-type":"application/xml; charset=\"UTF-8\""}
         requestPayload = """<?xml version="1.0" encoding="UTF-8"?>
         <CIM CIMVERSION="2.0" DTDVERSION="2.0"><MESSAGE ID="5" PROTOCOLVERSION="1.0"><SIMPLEREQ><METHODCALL NAME="CreateSessionToken"><LOCALCLASSPATH><LOCALNAMESPACEPATH><NAMESPACE NAME="root"/><NAMESPACE NAME="cimv2"/></LOCALNAMESPACEPATH><CLASSNAME NAME="VAMI_Authentication"/></LOCALCLASSPATH></METHODCALL></SIMPLEREQ></MESSAGE></CIM>"""
-        conn.request('POST', "/cimom", requestPayload, headers)
-        response = conn.getresponse()
-        status = response.status
-        if ( status == 200 and response.reason == 'OK'):
-            xmlResponse = response.read().decode(encoding='UTF-8')
+        status, reason, body = vami_pool.request(vRAInstance, 5480, 'POST', "/cimom", requestPayload, headers,
+                                                 idempotent=True)
+        if ( status == 200 and reason == 'OK'):
+            xmlResponse = body.decode(encoding='UTF-8')
             logging.debug("xmlResponse for token is: " + xmlResponse)
             lines = xmlResponse.splitlines()
             for line in lines:
@@ -207,12 +176,10 @@ class VRAConfigSettor:
                         break
         else:
             self.addToResultMessage("Error code: " + str(status))
-        conn.close()
         logging.debug("token is: " + token)
         return token
 
     def httpPost(self, vRAInstance, token, url, requestpayload, print_xml):
-        conn = httplib.HTTPSConnection(vRAInstance, 5480)
         credentialString = "root:" + token
         credentialStringBytes = credentialString.encode()
         encodedCreds = base64.encodestring(credentialStringBytes).decode().replace('\n','')
@@ -222,17 +189,14 @@ class VRAConfigSettor:
             self.addToResultMessage("CONSTRUCTED Payload for SSO configure post is:")
             self.addToResultMessage(requestpayload)
 
-        conn.request('POST', url, requestpayload, headers)
-        response = conn.getresponse()
-        status = response.status
-        reason = response.reason
-        xmlResponse = response.read().decode(encoding='UTF-8')
+        status, reason, body = vami_pool.request(vRAInstance, 5480, 'POST', url, requestpayload, headers)
+        xmlResponse = body.decode(encoding='UTF-8')
+        self.configPageValues.clear()
 
         if(print_xml == True):
             self.addToResultMessage("Post Response is:")
             self.addToResultMessage(xmlResponse)
 
-        conn.close()
         if(status == 200 and reason == 'OK'):
             logging.debug("Http post call returned successfully.")
             return True
@@ -269,7 +233,6 @@ class VRAConfigSettor:
         vra_ssl_org_unit=self.vra_ssl_org_unit
         vra_ssl_country=self.vra_ssl_country
 
-        conn = httplib.HTTPSConnection(vRAInstance, vra_host_port)
         credentialString = "root:" + token
         credentialStringBytes = credentialString.encode()
         encodedCreds = base64.encodestring(credentialStringBytes).decode().replace('\n','')
@@ -298,12 +261,9 @@ class VRAConfigSettor:
 
         logging.debug("ABOUT TO CALL POST FOR HostSettings and SSL")
 
-        conn.request('POST', "/service/cafe/config-page.py", requestPayload, headers)
-
-        response = conn.getresponse()
-        status = response.status
-        reason = response.reason
-        conn.close()
+        status, reason, body = vami_pool.request(vRAInstance, vra_host_port, 'POST', "/service/cafe/config-page.py",
+                                                 requestPayload, headers)
+        self.configPageValues.clear()
         if ( status == 200 and reason == 'OK'):
             self.addToResultMessage("Host and certificate configured successfully")
             return True
@@ -311,9 +271,8 @@ class VRAConfigSettor:
             self.addToResultMessage("Error code: " + str(status))
         return False
 
-    def getXMLForHostAndSSLConfigFromVRA(self, vRAInstance, token):
+    def getXMLForConfigPage(self, vRAInstance, token, requestid, action="query"):
 
-        conn = httplib.HTTPSConnection(vRAInstance, 5480)
         credentialString = "root:" + token
         credentialStringBytes = credentialString.encode()
         encodedCreds = base64.encodestring(credentialStringBytes).decode().replace('\n','')
@@ -321,22 +280,19 @@ class VRAConfigSettor:
         requestPayload = """<?xml version="1.0" encoding="utf-8"?>
                             <request>
                             <locale>en-US</locale>
-                            <action>submit</action>
-                            <requestid>serverInfo</requestid>
+                            <action>""" + action + """</action>
+                            <requestid>""" + requestid + """</requestid>
                             </request>
                         """
 
         logging.debug("payload is:" + requestPayload)
-        logging.debug("Calling http post to get HostSettings and SSL")
-
-        conn.request('POST', "/service/cafe/config-page.py", requestPayload, headers)
-        response = conn.getresponse()
-        xmlResponse = response.read().decode(encoding='UTF-8')
-        status = response.status
-        reason = response.reason
-        conn.close()
+        logging.debug("Calling http post to get " + requestid)
+
+        status, reason, body = vami_pool.request(vRAInstance, 5480, 'POST', "/service/cafe/config-page.py",
+                                                 requestPayload, headers, idempotent=True)
+        xmlResponse = body.decode(encoding='UTF-8')
         if ( status == 200 and reason == 'OK'):
-            self.addToResultMessage("GOT host settings and SSL config")
+            self.addToResultMessage("GOT " + requestid)
             return xmlResponse
 
         else:
@@ -345,9 +301,9 @@ class VRAConfigSettor:
 
     def checkHostAndSSLConfig(self, vRAInstance, token):
 
-        xmlResponse = self.getXMLForHostAndSSLConfigFromVRA(vRAInstance, token)
-        if( xmlResponse is not None):
-            found = self.parseResponseToSeeIfHostSettingsArePresent(xmlResponse)
+        values = self.getConfigPageValues(vRAInstance, token, "serverInfo")
+        if( values is not None):
+            found = self.checkHostSettingsArePresent(values)
             return found
         else:
             self.addToResultMessage("No xml response for Host setting and ssl. Assuming not set")
@@ -476,4 +432,5 @@ def main():
 
 from ansible.module_utils.basic import *
 from ansible.module_utils.facts import *
+from ansible.module_utils.vami import vami_pool, parse_config_page, CONFIG_PAGE_READ_ACTIONS
 main()
\ No newline at end of file
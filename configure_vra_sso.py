@@ -17,7 +17,7 @@
 import httplib
 import base64
 import sys
-import xml.dom.minidom as minidom
+import threading
 import time
 import logging
 
@@ -85,7 +85,7 @@ class VRASSOSettor:
 
     masterout = ""
 
-    def _init_(self):
+    def __init__(self):
         self.vra_host_name= ""
         self.vra_root_password = ""
         self.vra_host_port=""
@@ -97,6 +97,11 @@ class VRASSOSettor:
 
         self.vra_license_key = ""
 
+        # parsed config-page queries by requestid, cleared on every submit
+        self.configPageValues = {}
+        # getConfigPagesValues workers report errors from their own threads
+        self.resultLock = threading.Lock()
+
     def initializeHost(self, hostname, password, vra_host_port):
         self.vra_host_name= hostname
         self.vra_root_password = password
@@ -111,62 +116,80 @@ class VRASSOSettor:
     def initializeLicenseKeySettings(self,license_key):
         self.vra_license_key=license_key
 
-    def parseResponseToGetValue(self, xmlResponse, idkey):
+    def getConfigValue(self, values, idkey):
+        if idkey in values:
+            return values[idkey]
+
+        for id in sorted(values):
+            if idkey in id:
+                return values[id]
+
+        logging.debug("Parsed value for id from xml is None")
+        return None
 
-        #iterate lines
-        xmldoc = minidom.parseString(xmlResponse)
-        itemlist = xmldoc.getElementsByTagName('value')
+    def getConfigPageValues(self, vRAInstance, token, requestid):
+        """
+        Return the id to value dict of a config-page query, fetched and parsed
+        once per requestid until a submit invalidates it. None when the query
+        fails.
+        """
+        if requestid not in self.configPageValues:
+            xmlResponse = self.getXMLForConfigPage(vRAInstance, token, requestid)
+            if(xmlResponse is None):
+                return None
+            logging.debug(xmlResponse)
+            self.configPageValues[requestid] = parse_config_page(xmlResponse)[1]
 
-        found_value=None
-        for s in itemlist:
-            id = ""
-            value = ""
-            id=s.attributes['id'].value
+        return self.configPageValues[requestid]
 
+    def getConfigPagesValues(self, vRAInstance, token, requestids):
+        """
+        Fetch and parse several config-page queries at the same time, one
+        thread and pooled connection each, and return a dict of requestid
+        to its id to value dict, None for the queries that failed
+        """
+        results = {}
 
-            childNodes=s.childNodes
-            if( (childNodes is not None) and (len(childNodes) !=0) ):
-                value=s.childNodes[0].data
-                value = value[0:20]
+        def worker(requestid):
+            try:
+                results[requestid] = self.getConfigPageValues(vRAInstance, token, requestid)
+            except Exception as e:
+                logging.debug("Query for " + requestid + " failed: " + str(e))
+                results[requestid] = None
 
-            if(idkey in id):
-                found_value=value
+        threads = [threading.Thread(target=worker, args=(requestid,)) for requestid in requestids]
 
-        if(found_value is not None):
-            return found_value
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
 
-        logging.debug("Parsed value for id from xml is None")
-        return None
+        return results
 
 
     def getvRA(self, vRAInstance):
-        conn = httplib.HTTPSConnection(vRAInstance, 5480)
         headers = {"Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8", "Cache-Control": "no-cache"}
         try:
-            conn.request('GET', "/#core.Login", "", headers)
-            response = conn.getresponse()
-            conn.close()
+            status, reason, body = vami_pool.request(vRAInstance, 5480, 'GET', "/#core.Login", "", headers)
         except Exception as e:
             self.addToResultMessage("Error connecting to vra instance")
             return False
 
-        return (response.status == 200) and (response.reason == 'OK')
+        return (status == 200) and (reason == 'OK')
 
     def getvRAAuthToken(self, vRAInstance, vRARootPassword):
         logging.debug("Obtaining auth token")
         token = None
-        conn = httplib.HTTPSConnection(vRAInstance, 5480)
         credentialString = "root:"  + vRARootPassword
         credentialStringBytes = credentialString.encode()
         encodedCreds = base64.encodestring(credentialStringBytes).decode().replace('\n','')
         headers = {"Authorization": "Basic " + encodedCreds, "Accept": "text/html, text/xml, application/xml", "Cache-Control": "no-cache", "Accept-Encoding": "gzip, deflate", "Accept-Language": "en-US,en;q=0.8,pt;q=0.6", "Connection":"keep-alive", "Content-type":"application/xml; charset=\"UTF-8\""}
         requestPayload = """<?xml version="1.0" encoding="UTF-8"?>
         <CIM CIMVERSION="2.0" DTDVERSION="2.0"><MESSAGE ID="5" PROTOCOLVERSION="1.0"><SIMPLEREQ><METHODCALL NAME="CreateSessionToken"><LOCALCLASSPATH><LOCALNAMESPACEPATH><NAMESPACE NAME="root"/><NAMESPACE NAME="cimv2"/></LOCALNAMESPACEPATH><CLASSNAME NAME="VAMI_Authentication"/></LOCALCLASSPATH></METHODCALL></SIMPLEREQ></MESSAGE></CIM>"""
-        conn.request('POST', "/cimom", requestPayload, headers)
-        response = conn.getresponse()
-        status = response.status
-        if ( status == 200 and response.reason == 'OK'):
-            xmlResponse = response.read().decode(encoding='UTF-8')
+        status, reason, body = vami_pool.request(vRAInstance, 5480, 'POST', "/cimom", requestPayload, headers,
+                                                 idempotent=True)
+        if ( status == 200 and reason == 'OK'):
+            xmlResponse = body.decode(encoding='UTF-8')
             logging.debug("xmlResponse for token is: " + xmlResponse)
             lines = xmlResponse.splitlines()
             for line in lines:
@@ -178,12 +201,10 @@ class VRASSOSettor:
                         break
         else:
             self.addToResultMessage("Error code: " + str(status))
-        conn.close()
         logging.debug("token is: " + token)
         return token
 
     def httpPost(self, vRAInstance, token, url, requestpayload, print_xml):
-        conn = httplib.HTTPSConnection(vRAInstance, self.vra_host_port)
         credentialString = "root:" + token
         credentialStringBytes = credentialString.encode()
         encodedCreds = base64.encodestring(credentialStringBytes).decode().replace('\n','')
@@ -193,17 +214,14 @@ class VRASSOSettor:
             self.addToResultMessage("CONSTRUCTED Payload for SSO configure post is:")
             self.addToResultMessage(requestpayload)
 
-        conn.request('POST', url, requestpayload, headers)
-        response = conn.getresponse()
-        status = response.status
-        reason = response.reason
-        xmlResponse = response.read().decode(encoding='UTF-8')
+        status, reason, body = vami_pool.request(vRAInstance, self.vra_host_port, 'POST', url, requestpayload, headers)
+        xmlResponse = body.decode(encoding='UTF-8')
+        self.configPageValues.clear()
 
         if(print_xml == True):
             self.addToResultMessage("Post Response is:")
             self.addToResultMessage(xmlResponse)
 
-        conn.close()
         if(status == 200 and reason == 'OK'):
             logging.debug("Http post call returned successfully.")
             return True
@@ -243,7 +261,6 @@ class VRASSOSettor:
         vra_sso_user=self.vra_sso_user
         vra_sso_password=self.vra_sso_password
 
-        conn = httplib.HTTPSConnection(vRAInstance, port)
         credentialString = "root:" + token
         credentialStringBytes = credentialString.encode()
         encodedCreds = base64.encodestring(credentialStringBytes).decode().replace('\n','')
@@ -258,13 +275,10 @@ class VRASSOSettor:
         requestPayload += """ <value id="sso.password">""" + vra_sso_password + "</value>"
         requestPayload += """ <value id="sso.apply.branding">false</value> </request> """
 
-        conn.request('POST', "/service/cafe/config-page.py?confirmed", requestPayload, headers)
-        response = conn.getresponse()
-        status = response.status
-        reason = response.reason
-        xmlResponse = response.read().decode(encoding='UTF-8')
-
-        conn.close()
+        status, reason, body = vami_pool.request(vRAInstance, port, 'POST', "/service/cafe/config-page.py?confirmed",
+                                                 requestPayload, headers)
+        xmlResponse = body.decode(encoding='UTF-8')
+        self.configPageValues.clear()
 
         if ( status == 200 and reason == 'OK'):
             validate=self.checkSSOConfigExists(token)
@@ -278,9 +292,8 @@ class VRASSOSettor:
             self.addToResultMessage("Error configuring SSO. Error code: " + str(status))
             return False
 
-    def getXMLForLicenseConfigFromVRA(self, vRAInstance, token):
+    def getXMLForConfigPage(self, vRAInstance, token, requestid):
 
-        conn = httplib.HTTPSConnection(vRAInstance, 5480)
         credentialString = "root:" + token
         credentialStringBytes = credentialString.encode()
         encodedCreds = base64.encodestring(credentialStringBytes).decode().replace('\n','')
@@ -289,55 +302,18 @@ class VRASSOSettor:
                             <request>
                             <locale>en-US</locale>
                             <action>query</action>
-                            <requestid>licenseInfo</requestid>
+                            <requestid>""" + requestid + """</requestid>
                             </request>
                         """
 
-        #todo : avoid concatenation
         logging.debug("payload is:" + requestPayload)
-        logging.debug("Calling http post to get License")
-
-        conn.request('POST', "/service/cafe/config-page.py", requestPayload, headers)
-        response = conn.getresponse()
-        xmlResponse = response.read().decode(encoding='UTF-8')
-        status = response.status
-        reason = response.reason
-        conn.close()
-        #id="license.vcac.status.key"
-        if ( status == 200 and reason == 'OK'):
-            logging.debug("License config fetched successfully")
-            return xmlResponse
-
-        else:
-            self.addToResultMessage("Error code: " + str(status))
-            return None
-    def getXMLForSSOConfigFromVRA(self, vRAInstance, token):
+        logging.debug("Calling http post to get " + requestid)
 
-        conn = httplib.HTTPSConnection(vRAInstance, 5480)
-        credentialString = "root:" + token
-        credentialStringBytes = credentialString.encode()
-        encodedCreds = base64.encodestring(credentialStringBytes).decode().replace('\n','')
-        headers = {"Authorization": "Basic " + encodedCreds, "Content-Type": "text/plain;charset=UTF-8"}
-        requestPayload = """<?xml version="1.0" encoding="utf-8"?>
-                            <request>
-                            <locale>en-US</locale>
-                            <action>query</action>
-                            <requestid>ssoInfo</requestid>
-                            </request>
-                        """
-
-        #todo : avoid concatenation
-        logging.debug("payload is:" + requestPayload)
-        logging.debug("Calling http post to get sso info")
-
-        conn.request('POST', "/service/cafe/config-page.py", requestPayload, headers)
-        response = conn.getresponse()
-        xmlResponse = response.read().decode(encoding='UTF-8')
-        status = response.status
-        reason = response.reason
-        conn.close()
+        status, reason, body = vami_pool.request(vRAInstance, 5480, 'POST', "/service/cafe/config-page.py",
+                                                 requestPayload, headers, idempotent=True)
+        xmlResponse = body.decode(encoding='UTF-8')
         if ( status == 200 and reason == 'OK'):
-            logging.debug("sso config fetched successfully")
+            logging.debug(requestid + " fetched successfully")
             return xmlResponse
 
         else:
@@ -346,14 +322,13 @@ class VRASSOSettor:
 
     def checkLicenseConfig(self, vRAInstance, token):
 
-        xmlResponse = self.getXMLForLicenseConfigFromVRA(vRAInstance, token)
+        values = self.getConfigPageValues(vRAInstance, token, "licenseInfo")
         id="license.vcac.status.key"
         newValue = self.vra_license_key
         if(newValue is None):
             newValue=""
-        if( xmlResponse is not None):
-            logging.debug(xmlResponse)
-            value = self.parseResponseToGetValue(xmlResponse,id)
+        if( values is not None):
+            value = self.getConfigValue(values,id)
             if(value is None):
                 self.addToResultMessage("Current license value is None")
                 return False
@@ -372,11 +347,10 @@ class VRASSOSettor:
 
     def checkSSOConfigExists(self, token):
         vRAInstance=self.vra_host_name
-        xmlResponse = self.getXMLForSSOConfigFromVRA(vRAInstance, token)
+        values = self.getConfigPageValues(vRAInstance, token, "ssoInfo")
         id="sso.host"
-        if( xmlResponse is not None):
-            logging.debug(xmlResponse)
-            value = self.parseResponseToGetValue(xmlResponse,id)
+        if( values is not None):
+            value = self.getConfigValue(values,id)
             if(value is None):
                 self.addToResultMessage("Current sso host value is None")
                 return False
@@ -393,11 +367,10 @@ class VRASSOSettor:
     def checkSSOConfigIsSame(self, token):
         vRAInstance=self.vra_host_name
         newValue=self.vra_sso_host
-        xmlResponse = self.getXMLForSSOConfigFromVRA(vRAInstance, token)
+        values = self.getConfigPageValues(vRAInstance, token, "ssoInfo")
         id="sso.host"
-        if( xmlResponse is not None):
-            logging.debug(xmlResponse)
-            value = self.parseResponseToGetValue(xmlResponse,id)
+        if( values is not None):
+            value = self.getConfigValue(values,id)
             if(value is None or len(value)==0):
                 self.addToResultMessage("Current sso host value is None")
                 return False
@@ -416,7 +389,8 @@ class VRASSOSettor:
 
     def addToResultMessage(self, msg):
         logging.debug(msg)
-        self.masterout = self.masterout + msg + ". "
+        with self.resultLock:
+            self.masterout = self.masterout + msg + ". "
 
     def execute(self):
 
@@ -447,6 +421,9 @@ class VRASSOSettor:
             self.addToResultMessage("Login not successful ")
             return False, "Login not successful "
 
+        # read both pages the idempotency checks below need in one round trip
+        self.getConfigPagesValues(vra_host_name, token, ["ssoInfo", "licenseInfo"])
+
         start = time.time()
         maxTryCount=2
         tryCount=0
@@ -546,4 +523,5 @@ def main():
 
 from ansible.module_utils.basic import *
 from ansible.module_utils.facts import *
+from ansible.module_utils.vami import vami_pool, parse_config_page
 main()
\ No newline at end of file
@@ -21,6 +21,7 @@ except ImportError:
     import simplejson as json
 
 import atexit
+import re
 import ssl
 
 if hasattr(ssl, '_create_default_https_context') and hasattr(ssl, '_create_unverified_context'):
@@ -57,6 +58,51 @@ options:
             - cluster, datacenter, datastore, dvs, dvs-port, vm
         required: True
         default: Null
+    cache_dir:
+        description:
+            - Directory on the control node holding the name to moId index
+              shared with the vcenter_query module. Cached ids are checked to
+              still exist under that name before they are returned, and the
+              index is refreshed with WaitForUpdatesEx when the name is
+              missing or stale
+        required: False
+        default: Null
+    session_cache_dir:
+        description:
+            - Directory on the control node where the vCenter session cookie
+              is kept, readable by the current user only. Later runs reuse the
+              session while it is logged in instead of logging in again, and
+              the session is not logged out at exit
+        required: False
+        default: Null
+    datacenter:
+        description:
+            - Name of the datacenter the lookup is limited to
+        required: False
+        default: Null
+    folder:
+        description:
+            - Name of the folder the lookup is limited to, searched under
+              datacenter when given
+        required: False
+        default: Null
+    cluster:
+        description:
+            - Name of the cluster the lookup is limited to, searched under
+              datacenter and folder when given
+        required: False
+        default: Null
+    match:
+        description:
+            - How vcenter_object_name is matched. With glob or regex it is a
+              pattern and the custom fact is set to a dict of name to the
+              list of ids of the matching objects, which can share a name
+              across folders or datacenters
+            - Regex patterns are searched anywhere in the name unless
+              anchored with ^
+        required: False
+        choices: ['exact', 'glob', 'regex']
+        default: exact
 '''
 EXAMPLES = '''
 - name: Get vCenter ID
@@ -76,6 +122,16 @@ EXAMPLES = '''
 '''
 
 def si_connect(module):
+    session_cache_dir = module.params['session_cache_dir']
+
+    if session_cache_dir:
+        si = load_cached_session(session_cache_dir,
+                                 module.params['host'],
+                                 module.params['login'],
+                                 module.params['port'] or 443)
+        if si:
+            return si
+
     try:
         si = SmartConnect(host=module.params['host'],
                           user=module.params['login'],
@@ -85,21 +141,30 @@ def si_connect(module):
         failmsg = "Could not connect to virtualserver"
         module.fail_json(msg=failmsg)
 
-    atexit.register(Disconnect, si)
+    if session_cache_dir:
+        save_session(session_cache_dir,
+                     module.params['host'],
+                     module.params['login'],
+                     module.params['port'] or 443,
+                     si._stub)
+    else:
+        atexit.register(Disconnect, si)
 
     return si
 
-def get_id(module, si, vimtype, name, getobject=None, getmoid=None):
+def get_id(module, si, vimtype, name, getobject=None, getmoid=None, root=None):
     '''
     :param si service instance
     :param vimtype: valid vim type
     :param name: name of the target (module.params.get('vcenter_object_name'))
     :param getobject: specify True if wanting to return the target object
     :param getmoid: specify True if wanting to return the moId property
+    :param root: managed entity the search is limited to, the root folder if None
     '''
+    container = None
     try:
         content = si.RetrieveContent()
-        limit = content.rootFolder
+        limit = root or content.rootFolder
         container = content.viewManager.CreateContainerView(limit, vimtype, True)
 
         if name:
@@ -109,13 +174,57 @@ def get_id(module, si, vimtype, name, getobject=None, getmoid=None):
                         return str(x._moId)
                     if getobject:
                         return x
-                else:
-                    module.fail_json(msg="Could not find specified name: {}".format(name))
+            module.fail_json(msg="Could not find specified name: {}".format(name))
         else:
             module.fail_json(msg="Please specify a vcenter object name")
 
     except Exception as e:
         module.fail_json(msg="Failed to get id for: {} error: {}".format(name, e))
+    finally:
+        if container:
+            container.Destroy()
+
+
+def get_ids_by_pattern(module, si, vimtype, pattern, match, root=None):
+    '''
+    :param si service instance
+    :param vimtype: valid vim type
+    :param pattern: glob or regex the names are matched against
+    :param match: glob or regex
+    :param root: managed entity the search is limited to, the root folder if None
+    :return dict of name to the sorted moIds of the objects matching, the
+    names are read in one paged PropertyCollector call and only the range
+    starting with the literal prefix of pattern is tested
+    '''
+    if match == 'regex':
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            module.fail_json(msg="Invalid regex {}: {}".format(pattern, e))
+
+    found = find_names_by_pattern(build_inventory_index(si.RetrieveContent(), vimtype, root), pattern, match)
+
+    if not found:
+        module.fail_json(msg="Nothing matches {} pattern: {}".format(match, pattern))
+
+    return found
+
+
+def get_scope_root(module, si):
+    '''
+    :param si service instance
+    :return the datacenter, folder or cluster lookups are limited to, each
+    searched under the previous one, or None for the root folder
+    '''
+    root = None
+
+    for scope, vimtype in (('datacenter', vim.Datacenter),
+                           ('folder', vim.Folder),
+                           ('cluster', vim.ClusterComputeResource)):
+        if module.params[scope]:
+            root = get_id(module, si, [vimtype], module.params[scope], True, False, root)
+
+    return root
 
 
 def core(module):
@@ -138,11 +247,26 @@ def core(module):
         module.fail_json(msg="Please specify valid vim type: cluster, datacenter, datastore, vds, vm")
 
     si = si_connect(module)
+    root = get_scope_root(module, si)
+
+    if module.params['match'] != 'exact':
+        return False, get_ids_by_pattern(module, si, [vimtype], vcenter_object_name,
+                                         module.params['match'], root)
+
+    if module.params['cache_dir']:
+        found = find_cached_objects_by_name(si.RetrieveContent(),
+                                            module.params['cache_dir'],
+                                            module.params['host'],
+                                            [vimtype], [vcenter_object_name], root)
+        if vcenter_object_name not in found:
+            module.fail_json(msg="Could not find specified name: {}".format(vcenter_object_name))
+
+        return False, str(found[vcenter_object_name]._moId)
 
     vcenter_id = get_id(module, si,
                         [vimtype],
                         vcenter_object_name,
-                        False, True)
+                        False, True, root)
 
     return False, vcenter_id
 
@@ -156,7 +280,13 @@ def main():
             port=dict(type='int'),
             vcenter_object_name=dict(type='str'),
             vcenter_vim_type=dict(type='str'),
-            ansible_variable_name=dict(type='str')
+            ansible_variable_name=dict(type='str'),
+            cache_dir=dict(type='path'),
+            session_cache_dir=dict(type='path'),
+            datacenter=dict(type='str'),
+            folder=dict(type='str'),
+            cluster=dict(type='str'),
+            match=dict(type='str', default='exact', choices=['exact', 'glob', 'regex'])
         )
     )
 
@@ -181,6 +311,9 @@ def main():
 
 from ansible.module_utils.basic import *
 from ansible.module_utils.facts import *
+from ansible.module_utils.vcenter_session import load_cached_session, save_session
+from ansible.module_utils.vcenter_index import (build_inventory_index, find_names_by_pattern,
+                                                find_cached_objects_by_name)
 
 if __name__ == "__main__":
     main()
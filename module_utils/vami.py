@@ -0,0 +1,124 @@
+#
+#  Copyright 2015 VMware, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Keep-alive connections to the VAMI interface of vRA appliances, shared by
+the vra modules
+"""
+
+import atexit
+import socket
+import threading
+import xml.etree.cElementTree as ET
+from io import BytesIO
+
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+
+# config-page requestids that are not read with the query action, their
+# values only come back in the response to a submit with no values
+CONFIG_PAGE_READ_ACTIONS = {"serverInfo": "submit"}
+
+
+def parse_config_page(xml_response):
+    """
+    Return the statusCode and a dict of id to text of every <value> of a
+    config-page response, read in a single streaming pass
+    """
+    if not isinstance(xml_response, bytes):
+        xml_response = xml_response.encode('UTF-8')
+
+    status_code = None
+    values = {}
+    for event, elem in ET.iterparse(BytesIO(xml_response)):
+        if elem.tag == 'statusCode':
+            status_code = elem.text
+        elif elem.tag == 'value' and 'id' in elem.attrib:
+            values[elem.get('id')] = elem.text or ""
+            elem.clear()
+    return status_code, values
+
+
+class VAMIConnectionPool(object):
+    """
+    Keep-alive HTTPS connections to VAMI appliances, shared by every call of
+    the module run so an appliance is only shaken hands with once. Idle
+    connections are kept per (host, port) and checked out by one caller at
+    a time, so the pool can be used from several threads.
+    """
+
+    def __init__(self):
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def checkout(self, host, port):
+        with self.lock:
+            idle = self.idle.get((host, int(port)))
+            if idle:
+                return idle.pop()
+        return httplib.HTTPSConnection(host, int(port))
+
+    def checkin(self, host, port, conn):
+        with self.lock:
+            self.idle.setdefault((host, int(port)), []).append(conn)
+
+    def request(self, host, port, method, url, body="", headers=None, idempotent=None):
+        """
+        Send a request and return (status, reason, response body). The body
+        is always read so the connection can go back to the pool. A pooled
+        connection the appliance closed while idle is replaced once. Once
+        the request was sent it may have been acted upon, so a failure
+        reading the response is only retried for idempotent requests, GETs
+        unless told otherwise, and never for a config-page submit.
+        """
+        if idempotent is None:
+            idempotent = method == 'GET'
+
+        while True:
+            conn = self.checkout(host, port)
+            reused = conn.sock is not None
+            sent = False
+            try:
+                conn.request(method, url, body, headers or {})
+                sent = True
+                response = conn.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if reused and (idempotent or not sent):
+                    continue
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self.checkin(host, port, conn)
+
+            return response.status, response.reason, data
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle = {}
+
+
+vami_pool = VAMIConnectionPool()
+atexit.register(vami_pool.close)
@@ -0,0 +1,371 @@
+#
+#  Copyright 2015 VMware, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Paged PropertyCollector reads and name lookups, in memory or from the
+on-disk name to moId index per vCenter, scope and vim type kept up to date
+with WaitForUpdatesEx, shared by vcenter_query, vcenter_moid_query and
+get_vcenter_id
+"""
+
+import bisect
+import fnmatch
+import json
+import os
+import re
+
+try:
+    from pyVmomi import vim, vmodl, VmomiSupport
+except ImportError:
+    pass
+
+PROPERTY_PAGE_SIZE = 1000
+
+
+def view_filter_spec(view, vimtype, path_set):
+    """
+    Build a FilterSpec selecting path_set on every object of vimtype
+    reachable from the given ContainerView
+    """
+    traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(name='traverseView',
+                                                                 path='view',
+                                                                 skip=False,
+                                                                 type=vim.view.ContainerView)
+    object_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view,
+                                                           skip=True,
+                                                           selectSet=[traversal_spec])
+    property_specs = [vmodl.query.PropertyCollector.PropertySpec(type=t, pathSet=path_set)
+                      for t in vimtype]
+    return vmodl.query.PropertyCollector.FilterSpec(objectSet=[object_spec],
+                                                    propSet=property_specs)
+
+
+def retrieve_object_contents(content, filter_spec, page_size=None):
+    """
+    Yield the ObjectContent of every object selected by filter_spec, one
+    RetrievePropertiesEx page of page_size objects, PROPERTY_PAGE_SIZE by
+    default, at a time. When the generator is closed before the last page,
+    the retrieval is cancelled on the server.
+    """
+    collector = content.propertyCollector
+    options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=page_size or PROPERTY_PAGE_SIZE)
+    token = None
+
+    try:
+        result = collector.RetrievePropertiesEx([filter_spec], options)
+        while result:
+            token = result.token
+            for object_content in result.objects:
+                yield object_content
+            if not token:
+                break
+            result = collector.ContinueRetrievePropertiesEx(token)
+            token = None
+    finally:
+        if token:
+            collector.CancelRetrievePropertiesEx(token)
+
+
+def iter_obj_names(content, vimtype, root=None, page_size=None):
+    """
+    Yield (managed object, name) for every object of vimtype under root.
+    Only one page of results is held at a time, and closing the generator
+    early cancels the rest of the retrieval and destroys the view.
+    """
+    view = content.viewManager.CreateContainerView(root or content.rootFolder, vimtype, True)
+    object_contents = retrieve_object_contents(content, view_filter_spec(view, vimtype, ['name']), page_size)
+
+    try:
+        for object_content in object_contents:
+            for prop in object_content.propSet:
+                if prop.name == 'name':
+                    yield object_content.obj, prop.val
+    finally:
+        object_contents.close()
+        view.Destroy()
+
+
+class InventoryIndex(object):
+    """
+    Name index of managed objects from a streamed name scan: names and moId
+    strings in parallel lists sorted by name, without the managed object
+    proxies, so a pattern only tests the names sharing its literal prefix.
+    """
+
+    __slots__ = ('names', 'moids', '_sorted')
+
+    def __init__(self):
+        self.names = []
+        self.moids = []
+        self._sorted = True
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, moid):
+        if self.names and self._sorted and name < self.names[-1]:
+            self._sorted = False
+        self.names.append(name)
+        self.moids.append(moid)
+
+    def _sort(self):
+        if self._sorted:
+            return
+        order = sorted(range(len(self.names)), key=self.names.__getitem__)
+        self.names = [self.names[i] for i in order]
+        self.moids = [self.moids[i] for i in order]
+        self._sorted = True
+
+    def items(self, prefix=''):
+        """
+        Yield (name, moId) of every entry whose name starts with prefix,
+        found by bisecting the sorted names
+        """
+        self._sort()
+        for i in range(bisect.bisect_left(self.names, prefix), len(self.names)):
+            if not self.names[i].startswith(prefix):
+                break
+            yield self.names[i], self.moids[i]
+
+
+def build_inventory_index(content, vimtype, root=None):
+    """
+    Return an InventoryIndex of every object of vimtype under root, filled
+    from a streamed name scan without keeping the managed object proxies
+    """
+    index = InventoryIndex()
+    for mo, name in iter_obj_names(content, vimtype, root):
+        index.add(name, mo._moId)
+    return index
+
+
+def _pattern_prefix(pattern, match):
+    """
+    Return the literal text every name matching pattern starts with, ''
+    when the pattern does not start with one
+    """
+    if match == 'glob':
+        return re.split(r'[*?[]', pattern, 1)[0]
+
+    if not pattern.startswith('^') or '|' in pattern:
+        return ''
+
+    prefix = ''
+    for c in pattern[1:]:
+        if c in '.^$*+?{}[]\\()':
+            if c in '*?{':
+                prefix = prefix[:-1]
+            break
+        prefix += c
+    return prefix
+
+
+def find_names_by_pattern(objects, pattern, match):
+    """
+    Return a dict of name to the sorted moIds of every object whose name
+    matches a glob or regex pattern. objects is an InventoryIndex, of which
+    only the range of sorted names starting with the literal prefix of the
+    pattern is tested, or an iterable of (name, moId). Regex patterns are
+    searched anywhere in the name unless anchored with ^.
+    """
+    if isinstance(objects, InventoryIndex):
+        objects = objects.items(_pattern_prefix(pattern, match))
+
+    if match == 'glob':
+        matches = lambda name: fnmatch.fnmatchcase(name, pattern)
+    else:
+        regex = re.compile(pattern)
+        matches = lambda name: regex.search(name) is not None
+
+    found = {}
+    for name, moid in objects:
+        if matches(name):
+            found.setdefault(name, []).append(moid)
+
+    for moids in found.values():
+        moids.sort()
+
+    return found
+
+
+def _cache_file(cache_dir, hostname, vimtype, root=None, suffix=''):
+    # keyed by the types themselves, modules mapping one vim type option to
+    # different types must not share an index or its collector filter
+    types = '-'.join(sorted(t._wsdlName for t in vimtype))
+    if root:
+        return os.path.join(cache_dir, "{}_{}_{}{}.json".format(hostname, root._moId, types, suffix))
+    return os.path.join(cache_dir, "{}_{}{}.json".format(hostname, types, suffix))
+
+
+def load_index_cache(cache_dir, hostname, vimtype, root=None, suffix=''):
+    """
+    Load the name index cached for a vCenter, scope and list of types. The
+    index is a dict with the moId to (name, wsdl type) map in 'objects' and,
+    when it was built by a still usable session, the PropertyCollector and
+    ContainerView moIds and the WaitForUpdatesEx version to refresh it from.
+    Indexes with another suffix are kept apart, with a collector and version
+    of their own.
+    """
+    try:
+        with open(_cache_file(cache_dir, hostname, vimtype, root, suffix)) as cache_file:
+            index = json.load(cache_file)
+    except (IOError, ValueError):
+        return {'collector': None, 'view': None, 'version': None, 'objects': {}}
+
+    _compact_objects(index['objects'])
+
+    return index
+
+
+def _compact_objects(objects):
+    """
+    Replace the [name, wsdl type] lists json returns for each moId with
+    tuples sharing one string per wsdl type, in place. Managed object
+    proxies are only made for the entries a lookup hits.
+    """
+    wsdl_types = {}
+    for moid, (name, wsdl_type) in list(objects.items()):
+        objects[moid] = (name, wsdl_types.setdefault(wsdl_type, wsdl_type))
+
+
+def save_index_cache(cache_dir, hostname, vimtype, index, root=None, suffix=''):
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    path = _cache_file(cache_dir, hostname, vimtype, root, suffix)
+    tmp_path = "{}.{}".format(path, os.getpid())
+
+    with open(tmp_path, 'w') as cache_file:
+        json.dump(index, cache_file)
+    os.rename(tmp_path, path)
+
+
+def _wait_for_index_updates(collector, version, objects):
+    """
+    Apply every pending update of collector since version to objects and
+    return the new version. WaitForUpdatesEx returns None straight away
+    when nothing changed.
+    """
+    options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=0)
+
+    while True:
+        update_set = collector.WaitForUpdatesEx(version, options)
+        if update_set is None:
+            break
+
+        version = update_set.version
+        for filter_update in update_set.filterSet:
+            for object_update in filter_update.objectSet:
+                moid = object_update.obj._moId
+                if object_update.kind == 'leave':
+                    objects.pop(moid, None)
+                    continue
+                for change in object_update.changeSet:
+                    if change.name == 'name':
+                        objects.update({moid: (change.val, object_update.obj._wsdlName)})
+
+        if not update_set.truncated:
+            break
+
+    return version
+
+
+def refresh_index(content, vimtype, index, root=None):
+    """
+    Bring a cached index up to date. The PropertyCollector, its filter and
+    the ContainerView it watches belong to the session that created them,
+    so the incremental refresh only applies while that session is alive,
+    otherwise a new collector is created and the index rebuilt from it.
+    """
+    stub = content.propertyCollector._stub
+
+    if index.get('collector') and index.get('version'):
+        collector = vmodl.query.PropertyCollector(index['collector'], stub)
+        try:
+            index['version'] = _wait_for_index_updates(collector, index['version'], index['objects'])
+            return index
+        except (vim.fault.InvalidCollectorVersion, vmodl.fault.InvalidArgument):
+            # the collector is still alive on the session, which outlives the run
+            _destroy_index_collector(collector, index.get('view'), stub)
+        except (vmodl.fault.ManagedObjectNotFound, vim.fault.NotAuthenticated):
+            pass
+
+    collector = content.propertyCollector.CreatePropertyCollector()
+    view = content.viewManager.CreateContainerView(root or content.rootFolder, vimtype, True)
+    collector.CreateFilter(view_filter_spec(view, vimtype, ['name']), partialUpdates=False)
+
+    objects = {}
+    version = _wait_for_index_updates(collector, '', objects)
+
+    return {'collector': collector._moId, 'view': view._moId, 'version': version, 'objects': objects}
+
+
+def _destroy_index_collector(collector, view_moid, stub):
+    """
+    Destroy a collector an index can no longer be refreshed from, along
+    with its filter and the ContainerView it watched
+    """
+    try:
+        collector.DestroyPropertyCollector()
+        if view_moid:
+            vim.view.ContainerView(view_moid, stub).Destroy()
+    except vmodl.MethodFault:
+        pass
+
+
+def validate_cached_object(mo, object_name):
+    """
+    Return the managed object of a cache entry if it still exists under
+    the same name, None if the cache entry is stale
+    """
+    try:
+        name = mo.name
+    except vmodl.fault.ManagedObjectNotFound:
+        return None
+
+    if name != object_name:
+        return None
+
+    return mo
+
+
+def find_cached_objects_by_name(content, cache_dir, hostname, vimtype, names, root=None):
+    """
+    Resolve names of the objects of the vimtype list from the on-disk index.
+    Returns a dict of name to managed object. Cache hits are checked against
+    vCenter before being returned, the index is refreshed and saved when an
+    entry is missing or stale.
+    """
+    index = load_index_cache(cache_dir, hostname, vimtype, root)
+    stub = content.propertyCollector._stub
+    found = {}
+
+    for refreshed in (False, True):
+        for moid, (name, wsdl_type) in index['objects'].items():
+            if name not in names or name in found:
+                continue
+            mo = validate_cached_object(VmomiSupport.GetWsdlType('urn:vim25', wsdl_type)(moid, stub), name)
+            if mo:
+                found.update({name: mo})
+
+        if refreshed or len(found) == len(names):
+            break
+
+        index = refresh_index(content, vimtype, index, root)
+        save_index_cache(cache_dir, hostname, vimtype, index, root)
+
+    return found
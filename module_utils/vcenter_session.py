@@ -0,0 +1,106 @@
+#
+#  Copyright 2015 VMware, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+vCenter session cookies cached on the control node, shared by the modules
+taking a session_cache_dir option
+"""
+
+import hashlib
+import json
+import os
+import ssl
+
+try:
+    from pyVmomi import vim, SoapStubAdapter
+except ImportError:
+    pass
+
+
+def _session_cache_file(session_cache_dir, hostname, username, port):
+    key = "{}@{}:{}".format(username, hostname, port)
+    return os.path.join(session_cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+def load_cached_session(session_cache_dir, hostname, username, port, ssl_context=None):
+    """
+    Return a ServiceInstance for the vmware_soap_session cookie cached on the
+    control node, None when there is none or it is no longer logged in
+    """
+    try:
+        with open(_session_cache_file(session_cache_dir, hostname, username, port)) as f:
+            session = json.load(f)
+    except (IOError, ValueError):
+        return None
+
+    stub = SoapStubAdapter(host=hostname, port=port, version=session['version'], sslContext=ssl_context)
+    stub.cookie = session['cookie']
+    service_instance = vim.ServiceInstance('ServiceInstance', stub)
+
+    try:
+        # CurrentTime is answered without a login as well, currentSession
+        # is only set while the cookie is still authenticated
+        if service_instance.RetrieveContent().sessionManager.currentSession is None:
+            return None
+    except Exception:
+        return None
+
+    return service_instance
+
+
+def save_session(session_cache_dir, hostname, username, port, stub):
+    """
+    Store the session cookie of stub readable by the current user only
+    """
+    if not os.path.isdir(session_cache_dir):
+        os.makedirs(session_cache_dir, 0o700)
+
+    fd = os.open(_session_cache_file(session_cache_dir, hostname, username, port),
+                 os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'cookie': stub.cookie, 'version': stub.version}, f)
+
+
+def connect_to_vcenter(module):
+    """
+    connect_to_api for modules built on vmware_argument_spec, reusing the
+    session cached in session_cache_dir while it is logged in. Cached
+    sessions are not logged out at exit.
+    """
+    from ansible.module_utils.vmware import connect_to_api
+
+    session_cache_dir = module.params['session_cache_dir']
+
+    if not session_cache_dir:
+        return connect_to_api(module)
+
+    hostname = module.params['hostname']
+    username = module.params['username']
+    port = module.params.get('port') or 443
+
+    ssl_context = None
+    if not module.params['validate_certs']:
+        ssl_context = ssl._create_unverified_context()
+
+    service_instance = load_cached_session(session_cache_dir, hostname, username, port, ssl_context)
+    if service_instance:
+        return service_instance.RetrieveContent()
+
+    content = connect_to_api(module, disconnect_atexit=False)
+    save_session(session_cache_dir, hostname, username, port, content.propertyCollector._stub)
+
+    return content
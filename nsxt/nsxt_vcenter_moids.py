@@ -9,10 +9,11 @@ from pyVmomi import vim, vmodl
 from pyVim import connect
 from pyVim.connect import SmartConnect, SmartConnectNoSSL
 
-import json, time
+import json, ssl, time
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.vmware import vmware_argument_spec, request
 from ansible.module_utils._text import to_native
+from ansible.module_utils.vcenter_session import load_cached_session, save_session
 
 from ansible.module_utils.basic import *
 
@@ -32,25 +33,28 @@ logger.setLevel(10)
              'portgroup_name': [vim.dvs.DistributedVirtualPortgroup, vim.Network]} """
 
 
-def get_all_objs(module,content, vimtype):
+def get_all_objs(module,content, vimtype, root=None):
     obj = {}
-    container = content.viewManager.CreateContainerView(content.rootFolder,
+    container = content.viewManager.CreateContainerView(root or content.rootFolder,
                                                          vimtype, True)
-    for managed_object_ref in container.view:
-        obj.update({managed_object_ref: managed_object_ref.name})
+    try:
+        for managed_object_ref in container.view:
+            obj.update({managed_object_ref: managed_object_ref.name})
+    finally:
+        container.Destroy()
     return obj
 
 
-def find_object_by_name(module,content, object_name):
+def find_object_by_name(module,content, object_name, root=None):
     try:
     	if(object_name == module.params['datacenter']):
     	    vmware_objects = get_all_objs(module,content,[vim.Datacenter])
     	elif (object_name == module.params['cluster']):
-    	    vmware_objects = get_all_objs(module,content,[vim.ComputeResource])
+    	    vmware_objects = get_all_objs(module,content,[vim.ComputeResource], root)
     	elif (object_name == module.params['datastore']):
-            vmware_objects = get_all_objs(module,content,[vim.Datastore])
+            vmware_objects = get_all_objs(module,content,[vim.Datastore], root)
     	elif (object_name == module.params['portgroup1'] or module.params['portgroup2'] or module.params['portgroup3'] ):
-            vmware_objects = get_all_objs(module,content,[vim.dvs.DistributedVirtualPortgroup, vim.Network])
+            vmware_objects = get_all_objs(module,content,[vim.dvs.DistributedVirtualPortgroup, vim.Network], root)
  
     	for object in vmware_objects:
             if object.name == object_name:
@@ -64,6 +68,35 @@ def find_object_by_name(module,content, object_name):
 
 
 
+def connect_to_vcenter(module):
+    hostname = module.params['hostname']
+    username = module.params['username']
+    session_cache_dir = module.params['session_cache_dir']
+
+    if session_cache_dir:
+        si = load_cached_session(session_cache_dir, hostname, username, 443,
+                                 ssl._create_unverified_context())
+        if si:
+            logger.info("Reusing cached VCENTER SERVER session")
+            return si
+
+    try:
+        logger.info("Trying to connect to VCENTER SERVER . . .")
+        si = SmartConnectNoSSL(host=hostname,
+                               user=username,
+                               pwd=module.params['password'],
+                               port=443)
+        logger.info("Connected to VCENTER SERVER !")
+    except IOError, e:
+        logger.info("Connection failed {0}")
+        module.fail_json(changed=False, msg="Failed to connect vCenter")
+
+    if session_cache_dir:
+        save_session(session_cache_dir, hostname, username, 443, si._stub)
+
+    return si
+
+
 def main():
   argument_spec = vmware_argument_spec()
  
@@ -76,21 +109,11 @@ def main():
             datastore=dict(required=True,type='str'),
             portgroup1= dict(required=True,type='str'),
             portgroup2= dict(required=True, type='str'),
-            portgroup3=dict(required=True, type='str')))
+            portgroup3=dict(required=True, type='str'),
+            session_cache_dir=dict(required=False, type='path')))
 
   module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=True)
-  try:
-	logger.info("Trying to connect to VCENTER SERVER . . .")
-	si = SmartConnectNoSSL(host=module.params['hostname'],
-						   user=module.params['username'],
-						   pwd=module.params['password'],
-						   port=443)
-        logger.info("Connected to VCENTER SERVER !")
-  except IOError, e:
-	#pass
-	#atexit.register(Disconnect, si)
-	logger.info("Connection failed {0}")
-        module.fail_json(changed=False, msg="Failed to connect vCenter")
+  si = connect_to_vcenter(module)
   content = si.RetrieveContent()
 
   datacenter= module.params['datacenter']
@@ -103,15 +126,15 @@ def main():
   try:
   	datacenter_mo = find_object_by_name(module,content, datacenter)
   	datacenter_moid =  datacenter_mo._moId
-  	cluster_mo = find_object_by_name(module,content, cluster)
+  	cluster_mo = find_object_by_name(module,content, cluster, datacenter_mo)
   	cluster_moid = cluster_mo._moId
-  	datastore_mo = find_object_by_name(module,content, datastore)
+  	datastore_mo = find_object_by_name(module,content, datastore, datacenter_mo)
   	datastore_moid = datastore_mo._moId
-  	portgroup1_mo = find_object_by_name(module,content, portgroup1)
+  	portgroup1_mo = find_object_by_name(module,content, portgroup1, datacenter_mo)
   	portgroup1_moid = portgroup1_mo._moId
-  	portgroup2_mo = find_object_by_name(module,content, portgroup2)
+  	portgroup2_mo = find_object_by_name(module,content, portgroup2, datacenter_mo)
   	portgroup2_moid = portgroup2_mo._moId
-  	portgroup3_mo = find_object_by_name(module,content, portgroup3)
+  	portgroup3_mo = find_object_by_name(module,content, portgroup3, datacenter_mo)
  	portgroup3_moid = portgroup3_mo._moId
         #module.exit_json(changed=True, msg= "success")
   	module.exit_json(changed=True,datacenter_id=datacenter_moid,cluster_id=cluster_moid,datastore_id=datastore_moid, portgroup1_id=portgroup1_moid,portgroup2_id=portgroup2_moid,portgroup3_id=portgroup3_moid,
@@ -0,0 +1,325 @@
+#!/usr/bin/python
+#
+#  Copyright 2015 VMware, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+
+DOCUMENTATION = '''
+---
+module: vcenter_moid_query
+Short_description: Query vCenter for object names and paths by moId
+description:
+    Module will return the name and inventory path for given vcenter moIds,
+    the reverse of vcenter_query
+requirements:
+    - ansible 2.x
+    - pyvmomi 5.x +
+options:
+    hostname:
+        description:
+            - The hostname or IP address of the vSphere vCenter API server
+        required: True
+    username:
+        description:
+            - The username of the vSphere vCenter with Admin rights
+        required: True
+        aliases: ['user', 'admin']
+    password:
+        description:
+            - The password of the vSphere vCenter user
+        required: True
+        aliases: ['pass', 'pwd']
+    moids:
+        description:
+            - List of moIds to resolve, e.g. domain-c7 or vm-42, or items with
+              moid and vcenter_vim_type keys. Ids with a prefix before a
+              colon, like the NSX-T compute collection external ids, are
+              resolved by the part after the last colon
+            - The vim type is taken from the moId prefix unless given
+        required: True
+    vcenter_vim_type:
+        description:
+            - vCenter resource type of moIds without one of their own, valid
+              options are
+            - cluster, datacenter, datastore, vds, dvs-port, vm, folder, host,
+              resource-pool
+        required: False
+        default: Null
+    session_cache_dir:
+        description:
+            - Directory on the control node where the vCenter session cookie
+              is kept, readable by the current user only. Later runs reuse the
+              session while it is logged in instead of logging in again
+        required: False
+        default: Null
+'''
+
+EXAMPLES = '''
+- name: Get compute manager cluster names
+  vcenter_moid_query:
+    hostname: "{{ vcenter_hostname }}"
+    username: "{{ vcenter_username }}"
+    password: "{{ vcenter_pwd }}"
+    validate_certs: False
+    moids: "{{ compute_collections.results | map(attribute='external_id') | list }}"
+  register: compute_collection_names
+
+- name: Get portgroup path
+  vcenter_moid_query:
+    hostname: "{{ vcenter_hostname }}"
+    username: "{{ vcenter_username }}"
+    password: "{{ vcenter_pwd }}"
+    validate_certs: False
+    moids:
+      - moid: "{{ transport_portgroup_moid }}"
+        vcenter_vim_type: dvs-port
+'''
+
+RETURN = '''
+objects:
+    description: name, inventory path, vim type and parent moId keyed by moId
+    returned: success
+    type: dict
+    sample: {"domain-c7": {"name": "Cluster-A", "path": "DC1/host/Cluster-A",
+             "vim_type": "ClusterComputeResource", "parent": "group-h4"}}
+'''
+
+try:
+    from pyVmomi import vim, vmodl
+    HAS_PYVMOMI = True
+except ImportError:
+    HAS_PYVMOMI = False
+
+VIM_TYPE = {
+    'cluster': vim.ClusterComputeResource,
+    'datacenter': vim.Datacenter,
+    'datastore': vim.Datastore,
+    'vds': vim.dvs.VmwareDistributedVirtualSwitch,
+    'dvs-port': vim.Network,
+    'vm': vim.VirtualMachine,
+    'folder': vim.Folder,
+    'host': vim.HostSystem,
+    'resource-pool': vim.ResourcePool,
+}
+
+# moId prefixes vCenter hands out per type, longest first
+MOID_PREFIXES = [
+    ('dvportgroup-', vim.dvs.DistributedVirtualPortgroup),
+    ('datacenter-', vim.Datacenter),
+    ('datastore-', vim.Datastore),
+    ('resgroup-v', vim.VirtualApp),
+    ('resgroup-', vim.ResourcePool),
+    ('domain-c', vim.ClusterComputeResource),
+    ('domain-s', vim.ComputeResource),
+    ('network-', vim.Network),
+    ('group-p', vim.StoragePod),
+    ('group-', vim.Folder),
+    ('host-', vim.HostSystem),
+    ('dvs-', vim.dvs.VmwareDistributedVirtualSwitch),
+    ('vm-', vim.VirtualMachine),
+]
+
+def vim_type_for_moid(moid, vim_type=None):
+    """
+    Return the managed object type of moid from its prefix, narrowed to
+    vim_type when given. None when neither tells the type.
+    """
+    inferred = None
+    for prefix, mo_type in MOID_PREFIXES:
+        if moid.startswith(prefix):
+            inferred = mo_type
+            break
+
+    if vim_type is None:
+        return inferred
+
+    # a portgroup moId with dvs-port still needs the concrete type
+    if inferred is not None and issubclass(inferred, VIM_TYPE[vim_type]):
+        return inferred
+
+    return VIM_TYPE[vim_type]
+
+
+def ancestry_filter_spec(mos):
+    """
+    Return a FilterSpec selecting name and parent of mos and of every
+    ancestor up to the root folder, by following parent, and parentVApp
+    for vApp members, from each object
+    """
+    PropertyCollector = vmodl.query.PropertyCollector
+
+    select_set = [PropertyCollector.SelectionSpec(name='parent'),
+                  PropertyCollector.SelectionSpec(name='parentVApp')]
+
+    traversal_specs = [
+        PropertyCollector.TraversalSpec(name='parent', type=vim.ManagedEntity, path='parent',
+                                        skip=False, selectSet=select_set),
+        PropertyCollector.TraversalSpec(name='parentVApp', type=vim.VirtualMachine, path='parentVApp',
+                                        skip=False, selectSet=select_set),
+    ]
+
+    object_specs = [PropertyCollector.ObjectSpec(obj=mo, skip=False, selectSet=traversal_specs)
+                    for mo in mos]
+    property_specs = [PropertyCollector.PropertySpec(type=vim.ManagedEntity, pathSet=['name', 'parent']),
+                      PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=['parentVApp'])]
+
+    return PropertyCollector.FilterSpec(objectSet=object_specs, propSet=property_specs)
+
+
+def get_ancestry(content, mos):
+    """
+    Return a memo of moId to (name, parent moId, wsdl type) for mos and all
+    their ancestors, read in one PropertyCollector call. The collector
+    returns an ancestor shared by several objects once, and objects that
+    no longer exist are left out of the memo.
+    """
+    memo = {}
+    mos = list(mos)
+
+    while mos:
+        try:
+            object_contents = list(retrieve_object_contents(content, ancestry_filter_spec(mos)))
+        except vmodl.fault.ManagedObjectNotFound as e:
+            # a deleted object fails the whole call, drop it and retry. An
+            # ancestor removed meanwhile is not one of mos and is raised.
+            remaining = [mo for mo in mos if mo._moId != e.obj._moId]
+            if len(remaining) == len(mos):
+                raise
+            mos = remaining
+            continue
+        break
+    else:
+        return memo
+
+    for object_content in object_contents:
+        if object_content.missingSet:
+            continue
+        props = dict((prop.name, prop.val) for prop in object_content.propSet)
+        parent = props.get('parent') or props.get('parentVApp')
+        memo.update({object_content.obj._moId: (props.get('name'),
+                                                parent._moId if parent else None,
+                                                object_content.obj._wsdlName)})
+
+    return memo
+
+
+def inventory_path(moid, memo, paths):
+    """
+    Return the inventory path of moid as FindByInventoryPath takes it, the
+    names from below the root folder down joined with /. Paths are kept in
+    paths, so every ancestor path is built once.
+    """
+    if moid in paths:
+        return paths[moid]
+
+    name, parent, wsdl_type = memo[moid]
+
+    if parent is None or parent not in memo:
+        # the root folder is not part of inventory paths
+        path = None
+    else:
+        parent_path = inventory_path(parent, memo, paths)
+        path = name if parent_path is None else "{}/{}".format(parent_path, name)
+
+    paths.update({moid: path})
+
+    return path
+
+
+def get_moid_items(module, stub):
+    """
+    Return (requested moId, managed object) pairs for the moids option,
+    failing on moIds whose type can not be told
+    """
+    items = []
+
+    for item in module.params['moids']:
+        if isinstance(item, dict):
+            requested = item.get('moid')
+            vim_type = item.get('vcenter_vim_type') or module.params['vcenter_vim_type']
+        else:
+            requested = item
+            vim_type = module.params['vcenter_vim_type']
+
+        if not requested:
+            module.fail_json(msg="moids items require a moid key")
+        if vim_type is not None and vim_type not in VIM_TYPE:
+            module.fail_json(msg="Unsupported vcenter_vim_type {} for {}".format(vim_type, requested))
+
+        moid = requested.split(':')[-1]
+        mo_type = vim_type_for_moid(moid, vim_type)
+
+        if mo_type is None:
+            module.fail_json(msg="Failed to tell the vim type of {}, "
+                                 "set vcenter_vim_type".format(requested))
+
+        items.append((requested, mo_type(moid, stub)))
+
+    return items
+
+
+def main():
+
+    argument_spec = vmware_argument_spec()
+
+    argument_spec.update(
+        dict(
+            moids=dict(type='list', required=True),
+            vcenter_vim_type=dict(type='str', choices=sorted(VIM_TYPE)),
+            session_cache_dir=dict(type='path'),
+        )
+    )
+
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=True)
+
+    if not HAS_PYVMOMI:
+        module.fail_json(msg='pyvmomi is required for this module')
+
+    content = connect_to_vcenter(module)
+
+    items = get_moid_items(module, content.propertyCollector._stub)
+
+    try:
+        memo = get_ancestry(content, [mo for _, mo in items])
+    except vmodl.fault.ManagedObjectNotFound as e:
+        module.fail_json(msg="Failed to read the ancestry, {} no longer exists".format(e.obj._moId))
+    paths = {}
+
+    missing = [requested for requested, mo in items if mo._moId not in memo]
+
+    if missing:
+        module.fail_json(msg="Failed to get name for: {}".format(', '.join(missing)))
+
+    objects = {}
+    for requested, mo in items:
+        name, parent, wsdl_type = memo[mo._moId]
+        objects.update({requested: dict(name=name,
+                                        path=inventory_path(mo._moId, memo, paths),
+                                        vim_type=wsdl_type,
+                                        parent=parent)})
+
+    object_names = dict((k, v['name']) for k, v in objects.items())
+
+    module.exit_json(changed=False, objects=objects,
+                     ansible_facts=dict(vcenter_object_names=object_names))
+
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.vmware import *
+from ansible.module_utils.vcenter_session import connect_to_vcenter
+from ansible.module_utils.vcenter_index import retrieve_object_contents
+
+if __name__ == '__main__':
+    main()
@@ -43,13 +43,180 @@ options:
     vcenter_object_name:
         description:
             - vCenter inventory object name
-        required: True
+            - One of vcenter_object_name, vcenter_objects, inventory_path,
+              dns_name, ip_address, uuid, snapshot_dest or watch is required
+        required: False
         default: Null
     vcenter_vim_type:
         description:
             - vCenter resource type valid options are
-            - cluster, datacenter, datastore, vds, dvs-port, vm, folder
-        required: True
+            - cluster, datacenter, datastore, vds, dvs-port, vm, folder, host
+            - Required with vcenter_object_name, dns_name, ip_address and uuid
+        required: False
+        default: Null
+    properties:
+        description:
+            - Property paths to return for the object found, e.g. config.key,
+              config.distributedVirtualSwitch.uuid or summary.freeSpace,
+              returned in object_properties. Managed object references are
+              returned as their moId
+            - With vcenter_objects they apply to every item without a
+              properties key of its own, and are returned keyed by vim type
+              and object name in object_properties and the
+              vcenter_object_properties fact
+            - The properties of all objects found are read in one
+              PropertyCollector call on the same session as the lookup
+        required: False
+        default: Null
+    match:
+        description:
+            - How vcenter_object_name is matched. With glob or regex it is a
+              pattern and the moIds of all matching objects are returned in
+              object_ids and as the vcenter_object_ids fact, as a list per
+              name since objects in different folders or datacenters can
+              share one
+            - Regex patterns are searched anywhere in the name unless
+              anchored with ^
+        required: False
+        choices: ['exact', 'glob', 'regex']
+        default: exact
+    inventory_path:
+        description:
+            - Inventory path of the object, e.g. DC1/host/Cluster-A, resolved
+              with SearchIndex.FindByInventoryPath instead of an inventory scan
+            - When vcenter_vim_type is given the object must be of that type
+        required: False
+        default: Null
+    dns_name:
+        description:
+            - DNS name of a vm or host, resolved with SearchIndex.FindByDnsName
+        required: False
+        default: Null
+    ip_address:
+        description:
+            - IP address of a vm or host, resolved with SearchIndex.FindByIp
+        required: False
+        default: Null
+    uuid:
+        description:
+            - BIOS uuid of a vm or host, resolved with SearchIndex.FindByUuid
+        required: False
+        default: Null
+    vcenter_objects:
+        description:
+            - List of items with vcenter_object_name and vcenter_vim_type keys
+              resolved over a single session, each vim type is scanned once.
+              Items may also carry a properties list
+            - The moIds are returned in object_ids and as the
+              vcenter_object_ids fact, keyed by vim type and then object
+              name, so a name looked up as two vim types gets both
+            - Mutually exclusive with vcenter_object_name and the
+              inventory_path, dns_name, ip_address and uuid lookups
+        required: False
+        default: Null
+    cache_dir:
+        description:
+            - Directory on the control node holding a name to moId index per
+              vCenter and vim type. Lookups are answered from the index, each
+              hit is checked to still exist under that name, and the index is
+              refreshed with WaitForUpdatesEx when a name is missing or stale
+            - The index is not used when unset
+        required: False
+        default: Null
+    session_cache_dir:
+        description:
+            - Directory on the control node where the vCenter session cookie
+              is kept, readable by the current user only. Later runs reuse the
+              session while it is logged in instead of logging in again, and
+              the session is not logged out at exit, which also lets cache_dir
+              refresh its index incrementally
+        required: False
+        default: Null
+    tags:
+        description:
+            - vSphere tags, as category:tag or a tag name in any category. The
+              moIds of every vcenter_vim_type object carrying all of them are
+              returned in object_ids and as the vcenter_object_ids fact, as a
+              list per name
+            - The objects attached to all the tags are listed once per run
+              through the vAPI list-attached-objects-on-tags call, and
+              limited to datacenter, folder and cluster with one name scan
+              of the objects under them
+        required: False
+        default: Null
+    custom_attributes:
+        description:
+            - Dict of custom attribute name to value the objects must carry,
+              combined with tags when both are given
+            - Custom values of all vcenter_vim_type objects under the scope are
+              indexed from one paged scan
+        required: False
+        default: Null
+    watch:
+        description:
+            - Return the vcenter_vim_type objects created, renamed or removed
+              since the last watch run, in created, renamed and removed keyed
+              by moId and as the vcenter_object_changes fact. Requires
+              cache_dir, where the state of the previous watch run is kept
+              in a file of its own, so lookups refreshing the name index in
+              between do not consume the changes
+            - With session_cache_dir the changes are read with WaitForUpdatesEx
+              from the version stored in the watch state, otherwise, or when
+              the collector is gone, the inventory is scanned and compared
+              with the state. The first run reports every object as created
+        required: False
+        default: False
+    snapshot_dest:
+        description:
+            - Write the vim type, name, moId and parent moId of every object
+              of vcenter_vim_type, or of all vim types when it is not given,
+              to this file as JSON lines sorted by vim type and name
+            - Mutually exclusive with the lookup options
+        required: False
+        default: Null
+    snapshot_file:
+        description:
+            - Snapshot written by snapshot_dest to resolve vcenter_object_name
+              or vcenter_objects from instead of contacting vCenter.
+              datacenter, folder, cluster and cache_dir do not apply
+        required: False
+        default: Null
+    vcenters:
+        description:
+            - Further vCenters to run the vcenter_object_name or vcenter_objects
+              lookups on, as hostnames or dicts with hostname, username,
+              password, port and validate_certs keys. Settings left out are
+              taken from the module options
+            - hostname and every listed vCenter are queried concurrently, one
+              thread and session each, and the moIds are returned in results
+              and as the vcenter_query_results fact, keyed by vCenter
+              hostname, vim type and then object name
+            - Mutually exclusive with properties, tags, custom_attributes,
+              watch and snapshot_dest, which the concurrent lookups do not
+              support
+        required: False
+        default: Null
+    datacenter:
+        description:
+            - Name of the datacenter lookups are limited to, also applies to
+              dns_name, ip_address and uuid lookups
+        required: False
+        default: Null
+    folder:
+        description:
+            - Name of the folder lookups are limited to, searched under
+              datacenter when given
+            - Mutually exclusive with inventory_path, dns_name, ip_address
+              and uuid, the SearchIndex only limits lookups to a datacenter
+        required: False
+        default: Null
+    cluster:
+        description:
+            - Name of the cluster lookups are limited to, searched under
+              datacenter and folder when given
+            - Mutually exclusive with inventory_path, dns_name, ip_address
+              and uuid
+        required: False
         default: Null
 '''
 
@@ -65,11 +232,111 @@ EXAMPLES = '''
   register: ext_net_portgroup_moid
   tags:
     - validate_openstack
+
+- name: Get VIO deployment MOIDs
+  vcenter_query:
+    hostname: "{{ vio_oms_vcenter_hostname }}"
+    username: "{{ vio_oms_vcenter_username }}"
+    password: "{{ vio_oms_vcenter_pwd }}"
+    validate_certs: False
+    vcenter_objects:
+      - vcenter_object_name: "{{ vio_cluster_mgmt }}"
+        vcenter_vim_type: "cluster"
+      - vcenter_object_name: "{{ vio_val_extnet_portgroup }}"
+        vcenter_vim_type: "dvs-port"
+        properties:
+          - config.key
+          - config.distributedVirtualSwitch.uuid
+      - vcenter_object_name: "{{ vio_val_mgmt_portgroup }}"
+        vcenter_vim_type: "dvs-port"
+  tags:
+    - validate_openstack
+
+- name: Get management cluster MOID by inventory path
+  vcenter_query:
+    hostname: "{{ vio_oms_vcenter_hostname }}"
+    username: "{{ vio_oms_vcenter_username }}"
+    password: "{{ vio_oms_vcenter_pwd }}"
+    validate_certs: False
+    inventory_path: "{{ vio_datacenter }}/host/{{ vio_cluster_mgmt }}"
+    vcenter_vim_type: "cluster"
+
+- name: Get VTEP portgroup MOIDs
+  vcenter_query:
+    hostname: "{{ vio_oms_vcenter_hostname }}"
+    username: "{{ vio_oms_vcenter_username }}"
+    password: "{{ vio_oms_vcenter_pwd }}"
+    validate_certs: False
+    tags:
+      - "role:vtep"
+    vcenter_vim_type: "dvs-port"
+
+- name: Get VMs created, renamed or removed since the last drift check
+  vcenter_query:
+    hostname: "{{ vio_oms_vcenter_hostname }}"
+    username: "{{ vio_oms_vcenter_username }}"
+    password: "{{ vio_oms_vcenter_pwd }}"
+    validate_certs: False
+    vcenter_vim_type: "vm"
+    watch: True
+    cache_dir: "/var/cache/vcenter_query"
+    session_cache_dir: "/var/cache/vcenter_query/sessions"
+  register: vm_changes
+
+- name: Export the vCenter inventory index
+  vcenter_query:
+    hostname: "{{ vio_oms_vcenter_hostname }}"
+    username: "{{ vio_oms_vcenter_username }}"
+    password: "{{ vio_oms_vcenter_pwd }}"
+    validate_certs: False
+    snapshot_dest: "/tmp/{{ vio_oms_vcenter_hostname }}.jsonl"
+  run_once: True
+
+- name: Get External Network Portgroup MOID from the snapshot
+  vcenter_query:
+    hostname: "{{ vio_oms_vcenter_hostname }}"
+    username: "{{ vio_oms_vcenter_username }}"
+    password: "{{ vio_oms_vcenter_pwd }}"
+    snapshot_file: "/tmp/{{ vio_oms_vcenter_hostname }}.jsonl"
+    vcenter_object_name: "{{ vio_val_extnet_portgroup }}"
+    vcenter_vim_type: "dvs-port"
+
+- name: Get compute host MOIDs
+  vcenter_query:
+    hostname: "{{ vio_oms_vcenter_hostname }}"
+    username: "{{ vio_oms_vcenter_username }}"
+    password: "{{ vio_oms_vcenter_pwd }}"
+    validate_certs: False
+    vcenter_object_name: "esxi-comp-*"
+    vcenter_vim_type: "host"
+    match: glob
+
+- name: Get transport portgroup MOIDs on the management and edge vCenters
+  vcenter_query:
+    hostname: "{{ mgmt_vcenter_hostname }}"
+    username: "{{ vcenter_username }}"
+    password: "{{ vcenter_pwd }}"
+    validate_certs: False
+    vcenters:
+      - "{{ edge_vcenter_hostname }}"
+      - hostname: "{{ resource_vcenter_hostname }}"
+        password: "{{ resource_vcenter_pwd }}"
+    vcenter_objects:
+      - vcenter_object_name: "{{ transport_portgroup }}"
+        vcenter_vim_type: "dvs-port"
 '''
 
 try:
+    import atexit
     import json
-    from pyVmomi import vim, vmodl
+    import os
+    import re
+    import ssl
+    import threading
+    from datetime import datetime
+    from pyVim.connect import SmartConnect, Disconnect
+    from pyVmomi import vim, vmodl, VmomiSupport
+    from ansible.module_utils.six import integer_types, string_types
     HAS_PYVMOMI = True
 except ImportError:
     HAS_PYVMOMI = False
@@ -82,53 +349,921 @@ VIM_TYPE = {
     'dvs-port': [vim.Network],
     'vm': [vim.VirtualMachine],
     'folder': [vim.Folder],
+    'host': [vim.HostSystem],
 }
 
+SEARCH_INDEX_KEYS = ['inventory_path', 'dns_name', 'ip_address', 'uuid']
+
+# options query_vcenters does not support, besides watch
+VCENTERS_EXCLUSIVE_KEYS = ['properties', 'tags', 'custom_attributes', 'snapshot_dest']
+
+
+class VcenterQueryError(Exception):
+    pass
+
+
+class TagIndex(object):
+    """
+    Objects attached to vSphere tags, read through the vAPI REST endpoint.
+    The list calls only return ids, so category and tag names are read one
+    GET each, at most once per run and only until the name is found. The
+    associations of all the requested tags are then listed in one
+    list-attached-objects-on-tags call.
+    """
+
+    BASE_URL = "https://{}/rest/com/vmware/cis/{}"
+
+    def __init__(self, hostname, username, password, validate_certs=True):
+        self.hostname = hostname
+        self.validate_certs = validate_certs
+        self.session_id = None
+        self.session_id = self._request('session', 'POST', url_username=username,
+                                        url_password=password, force_basic_auth=True)
+        self.objects_by_tag = {}
+        self._cache = {}
+
+    def _request(self, path, method='GET', data=None, **kwargs):
+
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        if self.session_id:
+            headers['vmware-api-session-id'] = self.session_id
+
+        resp = open_url(self.BASE_URL.format(self.hostname, path), method=method,
+                        data=json.dumps(data) if data is not None else None,
+                        headers=headers, validate_certs=self.validate_certs, **kwargs)
+        body = resp.read()
+
+        return json.loads(body)['value'] if body else None
+
+    def _cached_request(self, path, method='GET'):
+
+        if (path, method) not in self._cache:
+            self._cache[(path, method)] = self._request(path, method)
+        return self._cache[(path, method)]
+
+    def _name(self, kind, id):
+        return self._cached_request('tagging/{}/id:{}'.format(kind, id))['name']
+
+    def _tag_ids(self, category_name, tag_name):
+
+        if category_name is None:
+            return [i for i in self._cached_request('tagging/tag') if self._name('tag', i) == tag_name]
+
+        # category names are unique, and tag names within a category
+        for category_id in self._cached_request('tagging/category'):
+            if self._name('category', category_id) != category_name:
+                continue
+            tag_ids = self._cached_request('tagging/tag/id:{}?~action=list-tags-for-category'.format(category_id),
+                                           'POST')
+            for tag_id in tag_ids:
+                if self._name('tag', tag_id) == tag_name:
+                    return [tag_id]
+            break
+
+        return []
+
+    def load(self, tags):
+        """
+        Index the objects attached to each tag, given as category:tag or as a
+        tag name in any category. Returns a dict of tag to the set of
+        (wsdl type, moId) attached to it.
+        """
+        ids_by_tag = {}
+        for tag in tags:
+            category_name, tag_name = tag.split(':', 1) if ':' in tag else (None, tag)
+            ids_by_tag[tag] = self._tag_ids(category_name, tag_name)
+
+        tag_ids = sorted(set(i for ids in ids_by_tag.values() for i in ids))
+
+        if tag_ids:
+            associations = self._request('tagging/tag-association?~action=list-attached-objects-on-tags',
+                                         'POST', dict(tag_ids=tag_ids))
+            for association in associations:
+                self.objects_by_tag[association['tag_id']] = set((o['type'], o['id'])
+                                                                 for o in association['object_ids'])
+
+        return dict((tag, set().union(*[self.objects_by_tag.get(i, set()) for i in ids]))
+                    for tag, ids in ids_by_tag.items())
+
+    def logout(self):
+        self._request('session', 'DELETE')
 
-def find_vcenter_object_by_name(content, vimtype, object_name):
 
-    vcenter_mos = get_all_objs(content, vimtype)
+def get_obj_properties(content, paths_by_mo):
+    """
+    Return a dict of managed object to a dict of property path to value for
+    a dict of managed object to property paths. All objects are read in a
+    single RetrievePropertiesEx call. Property specs are made per concrete
+    type, since a path like config.key is valid for a
+    DistributedVirtualPortgroup but not for every vim.Network. A path the
+    type does not have raises VcenterQueryError.
+    """
+    paths_by_type = {}
+    for mo, path_set in paths_by_mo.items():
+        paths_by_type.setdefault(type(mo), set()).update(path_set)
 
-    for mo, mo_name in vcenter_mos.items():
-        if mo_name == object_name:
-            return mo
+    object_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=mo, skip=False) for mo in paths_by_mo]
+    property_specs = [vmodl.query.PropertyCollector.PropertySpec(type=t, pathSet=sorted(path_set))
+                      for t, path_set in paths_by_type.items()]
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=object_specs,
+                                                           propSet=property_specs)
+
+    obj = dict((mo, dict((path, None) for path in path_set)) for mo, path_set in paths_by_mo.items())
+
+    try:
+        for object_content in retrieve_object_contents(content, filter_spec):
+            requested = obj.get(object_content.obj)
+            if requested is None:
+                continue
+            for prop in object_content.propSet:
+                if prop.name in requested:
+                    requested.update({prop.name: serialize_property(prop.val)})
+    except vmodl.query.InvalidProperty as e:
+        raise VcenterQueryError("Invalid property {}".format(_invalid_paths(paths_by_type, e.name)))
+
+    return obj
+
+
+def _invalid_paths(paths_by_type, name):
+    """
+    Describe the requested paths an InvalidProperty fault for name refers
+    to, with the types they were asked of. Types that do not have the first
+    property of a path at all are named in preference.
+    """
+    candidates = sorted(((path, t) for t, path_set in paths_by_type.items() for path in path_set
+                         if name in path.split('.')), key=lambda i: (i[0], i[1]._wsdlName))
+    missing = [(path, t) for path, t in candidates
+               if path.split('.')[0] not in set(p.name for p in t._GetPropertyList())]
+
+    return ', '.join("{} for {}".format(path, t._wsdlName) for path, t in missing or candidates) or name
+
+
+def serialize_property(value):
+    """
+    Convert a property value to something exit_json can return, managed
+    object references become their moId
+    """
+    if value is None or isinstance(value, (bool, float) + integer_types + string_types):
+        return value
+    if isinstance(value, vmodl.ManagedObject):
+        return value._moId
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, vmodl.DataObject):
+        return dict((p.name, serialize_property(getattr(value, p.name)))
+                    for p in value._GetPropertyList())
+    if isinstance(value, list):
+        return [serialize_property(v) for v in value]
+    return str(value)
+
+
+# suffix of the index files holding the state of the previous watch run
+WATCH_STATE = '.watch'
+
+
+def diff_index_objects(before, after):
+    """
+    Return the moId to name dicts of objects created and removed between
+    two index object maps, and moId to old and new name of those renamed
+    """
+    created = dict((moid, v[0]) for moid, v in after.items() if moid not in before)
+    removed = dict((moid, v[0]) for moid, v in before.items() if moid not in after)
+    renamed = dict((moid, dict(old=before[moid][0], new=v[0])) for moid, v in after.items()
+                   if moid in before and before[moid][0] != v[0])
+
+    return created, renamed, removed
+
+
+def custom_attribute_index(content, vimtype, root=None):
+    """
+    Return a dict of (custom attribute name, value) to the set of objects
+    of vimtype carrying it, and a dict of object to name, built from one
+    paged scan of name and customValue
+    """
+    field_names = dict((f.key, f.name) for f in content.customFieldsManager.field or [])
+    index = {}
+    names = {}
+
+    view = content.viewManager.CreateContainerView(root or content.rootFolder, vimtype, True)
+    try:
+        for object_content in retrieve_object_contents(content, view_filter_spec(view, vimtype,
+                                                                                 ['name', 'customValue'])):
+            props = dict((prop.name, prop.val) for prop in object_content.propSet)
+            names.update({object_content.obj: props.get('name')})
+            for custom_value in props.get('customValue') or []:
+                key = (field_names.get(custom_value.key), custom_value.value)
+                index.setdefault(key, set()).add(object_content.obj)
+    finally:
+        view.Destroy()
+
+    return index, names
+
+
+def _vim_type_key(mo, vim_types):
+    for vim_type in vim_types:
+        if isinstance(mo, tuple(VIM_TYPE[vim_type])):
+            return vim_type
     return None
 
 
+def export_snapshot(content, snapshot_dest, vim_types, root=None):
+    """
+    Write the vim type, name, moId and parent moId of every object of
+    vim_types under root to snapshot_dest, one compact JSON object per line
+    sorted by vim type and name, all read over a single paged scan.
+    Returns the number of objects written.
+    """
+    vimtype = [t for vim_type in vim_types for t in VIM_TYPE[vim_type]]
+    view = content.viewManager.CreateContainerView(root or content.rootFolder, vimtype, True)
+    entries = []
+
+    try:
+        for object_content in retrieve_object_contents(content, view_filter_spec(view, vimtype, ['name', 'parent'])):
+            props = dict((prop.name, prop.val) for prop in object_content.propSet)
+            parent = props.get('parent')
+            entries.append((_vim_type_key(object_content.obj, vim_types),
+                            props.get('name'),
+                            object_content.obj._moId,
+                            parent._moId if parent else None))
+    finally:
+        view.Destroy()
+
+    entries.sort()
+
+    snapshot_dir = os.path.dirname(os.path.abspath(snapshot_dest))
+    if not os.path.isdir(snapshot_dir):
+        os.makedirs(snapshot_dir)
+
+    tmp_path = "{}.{}".format(snapshot_dest, os.getpid())
+    with open(tmp_path, 'w') as snapshot:
+        for vim_type, name, moid, parent in entries:
+            snapshot.write(json.dumps(dict(type=vim_type, name=name, moid=moid, parent=parent),
+                                      separators=(',', ':'), sort_keys=True))
+            snapshot.write('\n')
+    os.rename(tmp_path, snapshot_dest)
+
+    return len(entries)
+
+
+def iter_snapshot(snapshot_file, vim_type):
+    """
+    Yield the snapshot entries of vim_type in name order. Reading stops
+    once past that type since the file is sorted.
+    """
+    with open(snapshot_file) as snapshot:
+        for line in snapshot:
+            entry = json.loads(line)
+            if entry['type'] < vim_type:
+                continue
+            if entry['type'] > vim_type:
+                break
+            yield entry
+
+
+def find_snapshot_objects_by_name(snapshot_file, names_by_type):
+    """
+    Resolve names from a snapshot file without contacting vCenter. Returns
+    a dict of (vim type, object name) to moId, names that are not in the
+    snapshot are left out.
+    """
+    found = {}
+
+    for vim_type, names in names_by_type.items():
+        last_name = max(names)
+        for entry in iter_snapshot(snapshot_file, vim_type):
+            if entry['name'] in names:
+                found.setdefault((vim_type, entry['name']), entry['moid'])
+            if entry['name'] >= last_name:
+                break
+
+    return found
+
+
+def find_vcenter_object_by_name(content, vimtype, object_name, root=None):
+
+    vcenter_mos = iter_obj_names(content, vimtype, root)
+
+    try:
+        for mo, mo_name in vcenter_mos:
+            if mo_name == object_name:
+                return mo
+    finally:
+        vcenter_mos.close()
+    return None
+
+
+def find_vcenter_objects_by_name(content, vcenter_objects, cache_dir=None, hostname=None, root=None):
+    """
+    Resolve a list of vcenter_object_name/vcenter_vim_type items, scanning
+    each vim type once and stopping as soon as all its names are found.
+    Returns a dict of (vim type, object name) to managed object, names that
+    could not be found are left out.
+    """
+    names_by_type = {}
+    for item in vcenter_objects:
+        names_by_type.setdefault(item['vcenter_vim_type'], set()).add(item['vcenter_object_name'])
+
+    found = {}
+    for vim_type, names in names_by_type.items():
+        if cache_dir:
+            found.update(((vim_type, name), mo) for name, mo in
+                         find_cached_objects_by_name(content, cache_dir, hostname, VIM_TYPE[vim_type],
+                                                     names, root).items())
+            continue
+        pending = set(names)
+        vcenter_mos = iter_obj_names(content, VIM_TYPE[vim_type], root)
+        try:
+            for mo, mo_name in vcenter_mos:
+                if mo_name in pending:
+                    found.update({(vim_type, mo_name): mo})
+                    pending.discard(mo_name)
+                    if not pending:
+                        break
+        finally:
+            vcenter_mos.close()
+
+    return found
+
+
+def nest_by_vim_type(found):
+    """
+    Turn a dict keyed by (vim type, object name) into one keyed by vim type
+    and then object name
+    """
+    nested = {}
+    for (vim_type, name), value in found.items():
+        nested.setdefault(vim_type, {}).update({name: value})
+    return nested
+
+
+def missing_objects(vcenter_objects, found):
+    """
+    Return the vim type and name of the vcenter_objects items not in found
+    """
+    return ["{} {}".format(i['vcenter_vim_type'], i['vcenter_object_name']) for i in vcenter_objects
+            if (i['vcenter_vim_type'], i['vcenter_object_name']) not in found]
+
+
+def connect_to_endpoint(hostname, username, password, port=443, validate_certs=True,
+                        session_cache_dir=None):
+    """
+    Log in to a vCenter given explicitly rather than through module.params,
+    reusing the session cached in session_cache_dir while it is logged in
+    """
+    ssl_context = None
+    if not validate_certs:
+        ssl_context = ssl._create_unverified_context()
+
+    if session_cache_dir:
+        service_instance = load_cached_session(session_cache_dir, hostname, username, port, ssl_context)
+        if service_instance:
+            return service_instance.RetrieveContent()
+
+    service_instance = SmartConnect(host=hostname, user=username, pwd=password,
+                                    port=port, sslContext=ssl_context)
+
+    if session_cache_dir:
+        save_session(session_cache_dir, hostname, username, port, service_instance._stub)
+    else:
+        atexit.register(Disconnect, service_instance)
+
+    return service_instance.RetrieveContent()
+
+
+def find_vcenter_object_by_search_index(content, key, value, vim_type=None, datacenter=None):
+    """
+    Resolve an object server side through the SearchIndex in a single call.
+    dns_name, ip_address and uuid lookups apply to the vm and host vim types
+    and can be limited to a datacenter, inventory paths are absolute.
+    """
+    search_index = content.searchIndex
+
+    if key == 'inventory_path':
+        return search_index.FindByInventoryPath(value)
+
+    vm_search = vim_type == 'vm'
+
+    if key == 'dns_name':
+        return search_index.FindByDnsName(datacenter=datacenter, dnsName=value, vmSearch=vm_search)
+    if key == 'ip_address':
+        return search_index.FindByIp(datacenter=datacenter, ip=value, vmSearch=vm_search)
+
+    return search_index.FindByUuid(datacenter=datacenter, uuid=value, vmSearch=vm_search)
+
+
+def resolve_scope_root(content, datacenter=None, folder=None, cluster=None):
+    """
+    Return the managed entity lookups are rooted at, narrowing from the
+    datacenter to the folder and then the cluster that are given, each
+    searched under the previous one. None means the root folder.
+    """
+    root = None
+
+    for scope, vimtype, scope_name in (('datacenter', [vim.Datacenter], datacenter),
+                                       ('folder', [vim.Folder], folder),
+                                       ('cluster', [vim.ClusterComputeResource], cluster)):
+        if not scope_name:
+            continue
+        scope_mo = find_vcenter_object_by_name(content, vimtype, scope_name, root)
+        if not scope_mo:
+            raise VcenterQueryError("Failed to find {}: {}".format(scope, scope_name))
+        root = scope_mo
+
+    return root
+
+
+def get_scope_root(module, content):
+
+    try:
+        return resolve_scope_root(content,
+                                  module.params['datacenter'],
+                                  module.params['folder'],
+                                  module.params['cluster'])
+    except VcenterQueryError as e:
+        module.fail_json(msg=str(e))
+
+
+def query_object(module, content, root=None):
+
+    vim_type = module.params['vcenter_vim_type']
+
+    if vim_type not in VIM_TYPE:
+        module.fail_json(msg="Invalid vcenter_vim_type: {}".format(vim_type))
+
+    object_name = module.params['vcenter_object_name']
+
+    if module.params['cache_dir']:
+        vcenter_mo = find_cached_objects_by_name(content, module.params['cache_dir'],
+                                                 module.params['hostname'],
+                                                 VIM_TYPE[vim_type], [object_name], root).get(object_name)
+    else:
+        vcenter_mo = find_vcenter_object_by_name(content, VIM_TYPE[vim_type], object_name, root)
+
+    if not vcenter_mo:
+        module.fail_json(msg="Failed to get MOID for: {}".format(module.params['vcenter_object_name']))
+
+    if module.params['properties']:
+        try:
+            object_properties = get_obj_properties(content, {vcenter_mo: module.params['properties']})
+        except VcenterQueryError as e:
+            module.fail_json(msg=str(e))
+        module.exit_json(changed=False, object_id=vcenter_mo._moId,
+                         object_properties=object_properties[vcenter_mo])
+
+    module.exit_json(changed=False, object_id=vcenter_mo._moId)
+
+
+def query_pattern(module, content, root=None):
+
+    vim_type = module.params['vcenter_vim_type']
+    pattern = module.params['vcenter_object_name']
+    match = module.params['match']
+
+    if vim_type not in VIM_TYPE:
+        module.fail_json(msg="Invalid vcenter_vim_type: {}".format(vim_type))
+
+    if match == 'regex':
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            module.fail_json(msg="Invalid regex {}: {}".format(pattern, str(e)))
+
+    cache_dir = module.params['cache_dir']
+    hostname = module.params['hostname']
+
+    if cache_dir:
+        index = refresh_index(content, VIM_TYPE[vim_type],
+                              load_index_cache(cache_dir, hostname, VIM_TYPE[vim_type], root), root)
+        save_index_cache(cache_dir, hostname, VIM_TYPE[vim_type], index, root)
+        objects = ((name, moid) for moid, (name, wsdl_type) in index['objects'].items())
+    else:
+        objects = build_inventory_index(content, VIM_TYPE[vim_type], root)
+
+    object_ids = find_names_by_pattern(objects, pattern, match)
+
+    if not object_ids:
+        module.fail_json(msg="No {} matches {} pattern: {}".format(vim_type, match, pattern))
+
+    module.exit_json(changed=False, object_ids=object_ids,
+                     ansible_facts=dict(vcenter_object_ids=object_ids))
+
+
+def query_snapshot(module):
+
+    snapshot_file = module.params['snapshot_file']
+    match = module.params['match']
+
+    if not os.path.isfile(snapshot_file):
+        module.fail_json(msg="Snapshot file not found: {}".format(snapshot_file))
+
+    if module.params['vcenter_objects']:
+        vcenter_objects = module.params['vcenter_objects']
+        validate_vcenter_objects(module, vcenter_objects)
+    else:
+        vim_type = module.params['vcenter_vim_type']
+        if vim_type not in VIM_TYPE:
+            module.fail_json(msg="Invalid vcenter_vim_type: {}".format(vim_type))
+
+        if match != 'exact':
+            pattern = module.params['vcenter_object_name']
+            objects = ((entry['name'], entry['moid']) for entry in iter_snapshot(snapshot_file, vim_type))
+            object_ids = find_names_by_pattern(objects, pattern, match)
+            if not object_ids:
+                module.fail_json(msg="No {} matches {} pattern: {}".format(vim_type, match, pattern))
+            module.exit_json(changed=False, object_ids=object_ids,
+                             ansible_facts=dict(vcenter_object_ids=object_ids))
+
+        vcenter_objects = [dict(vcenter_object_name=module.params['vcenter_object_name'],
+                                vcenter_vim_type=vim_type)]
+
+    names_by_type = {}
+    for item in vcenter_objects:
+        names_by_type.setdefault(item['vcenter_vim_type'], set()).add(item['vcenter_object_name'])
+
+    found = find_snapshot_objects_by_name(snapshot_file, names_by_type)
+
+    missing = missing_objects(vcenter_objects, found)
+
+    if missing:
+        module.fail_json(msg="Failed to get MOID for: {}".format(', '.join(missing)))
+
+    if not module.params['vcenter_objects']:
+        module.exit_json(changed=False, object_id=list(found.values())[0])
+
+    object_ids = nest_by_vim_type(found)
+
+    module.exit_json(changed=False, object_ids=object_ids,
+                     ansible_facts=dict(vcenter_object_ids=object_ids))
+
+
+def query_export_snapshot(module, content, root=None):
+
+    vim_types = sorted(VIM_TYPE)
+
+    if module.params['vcenter_vim_type']:
+        vim_types = [module.params['vcenter_vim_type']]
+        if vim_types[0] not in VIM_TYPE:
+            module.fail_json(msg="Invalid vcenter_vim_type: {}".format(vim_types[0]))
+
+    count = export_snapshot(content, module.params['snapshot_dest'], vim_types, root)
+
+    module.exit_json(changed=True, snapshot_dest=module.params['snapshot_dest'], objects=count)
+
+
+def query_watch(module, content, root=None):
+
+    vim_type = module.params['vcenter_vim_type']
+    cache_dir = module.params['cache_dir']
+    hostname = module.params['hostname']
+
+    if vim_type not in VIM_TYPE:
+        module.fail_json(msg="Invalid vcenter_vim_type: {}".format(vim_type))
+
+    if not cache_dir:
+        module.fail_json(msg="watch requires cache_dir")
+
+    index = load_index_cache(cache_dir, hostname, VIM_TYPE[vim_type], root, WATCH_STATE)
+    before = dict(index['objects'])
+
+    index = refresh_index(content, VIM_TYPE[vim_type], index, root)
+    save_index_cache(cache_dir, hostname, VIM_TYPE[vim_type], index, root, WATCH_STATE)
+
+    created, renamed, removed = diff_index_objects(before, index['objects'])
+    module.exit_json(changed=False, objects=len(index['objects']),
+                     created=created, renamed=renamed, removed=removed,
+                     ansible_facts=dict(vcenter_object_changes=dict(created=created,
+                                                                    renamed=renamed,
+                                                                    removed=removed)))
+
+
+def query_tagged(module, content, root=None):
+
+    vim_type = module.params['vcenter_vim_type']
+    tags = module.params['tags']
+    custom_attributes = module.params['custom_attributes']
+
+    if vim_type not in VIM_TYPE:
+        module.fail_json(msg="Invalid vcenter_vim_type: {}".format(vim_type))
+
+    vimtype = tuple(VIM_TYPE[vim_type])
+    stub = content.propertyCollector._stub
+    matched = None
+    names = {}
+
+    if custom_attributes:
+        index, names = custom_attribute_index(content, list(vimtype), root)
+        for attribute, value in custom_attributes.items():
+            mos = index.get((attribute, str(value)), set())
+            matched = mos if matched is None else matched & mos
+
+    if tags:
+        try:
+            tag_index = TagIndex(module.params['hostname'], module.params['username'],
+                                 module.params['password'], module.params['validate_certs'])
+            try:
+                objects_by_tag = tag_index.load(tags)
+            finally:
+                tag_index.logout()
+        except Exception as e:
+            module.fail_json(msg="Failed to read tags from {}: {}".format(module.params['hostname'], str(e)))
+
+        for tag in tags:
+            mos = set()
+            for wsdl_type, moid in objects_by_tag[tag]:
+                # tags also attach to objects outside vim25, like content library items
+                try:
+                    mo_type = VmomiSupport.GetWsdlType('urn:vim25', wsdl_type)
+                except KeyError:
+                    continue
+                if issubclass(mo_type, vimtype):
+                    mos.add(mo_type(moid, stub))
+            matched = mos if matched is None else matched & mos
+
+        # tag associations are vCenter wide, custom_attribute_index already
+        # only holds the objects under root
+        if root and not custom_attributes and matched:
+            names = dict(iter_obj_names(content, list(vimtype), root))
+            matched = matched & set(names)
+
+    matched = matched or set()
+    unnamed = [mo for mo in matched if mo not in names]
+
+    if unnamed:
+        names.update((mo, props['name']) for mo, props in
+                     get_obj_properties(content, dict((mo, ['name']) for mo in unnamed)).items())
+
+    object_ids = {}
+    for mo in sorted(matched, key=lambda mo: mo._moId):
+        object_ids.setdefault(names[mo], []).append(mo._moId)
+
+    if not object_ids:
+        module.fail_json(msg="No {} matches the given tags and custom attributes".format(vim_type))
+
+    module.exit_json(changed=False, object_ids=object_ids,
+                     ansible_facts=dict(vcenter_object_ids=object_ids))
+
+
+def query_search_index(module, content, root=None):
+
+    key = [k for k in SEARCH_INDEX_KEYS if module.params[k]][0]
+    value = module.params[key]
+    vim_type = module.params['vcenter_vim_type']
+
+    if key != 'inventory_path' and vim_type not in ('vm', 'host'):
+        module.fail_json(msg="vcenter_vim_type must be vm or host to look up by {}".format(key))
+
+    if vim_type and vim_type not in VIM_TYPE:
+        module.fail_json(msg="Invalid vcenter_vim_type: {}".format(vim_type))
+
+    # folder and cluster are mutually exclusive with the SearchIndex keys,
+    # so root is the datacenter when one is given
+    vcenter_mo = find_vcenter_object_by_search_index(content, key, value, vim_type, root)
+
+    if vcenter_mo and vim_type and not isinstance(vcenter_mo, tuple(VIM_TYPE[vim_type])):
+        vcenter_mo = None
+
+    if not vcenter_mo:
+        module.fail_json(msg="Failed to get MOID for {}: {}".format(key, value))
+
+    module.exit_json(changed=False, object_id=vcenter_mo._moId)
+
+
+def validate_vcenter_objects(module, vcenter_objects):
+
+    for item in vcenter_objects:
+        if not isinstance(item, dict) or not item.get('vcenter_object_name'):
+            module.fail_json(msg="Each vcenter_objects item requires vcenter_object_name: {}".format(item))
+        if item.get('vcenter_vim_type') not in VIM_TYPE:
+            module.fail_json(msg="Invalid vcenter_vim_type for {}: {}".format(item['vcenter_object_name'],
+                                                                              item.get('vcenter_vim_type')))
+        if not isinstance(item.get('properties') or [], list):
+            module.fail_json(msg="properties of {} must be a list".format(item['vcenter_object_name']))
+
+
+def query_objects(module, content, root=None):
+
+    vcenter_objects = module.params['vcenter_objects']
+
+    validate_vcenter_objects(module, vcenter_objects)
+
+    vcenter_mos = find_vcenter_objects_by_name(content, vcenter_objects,
+                                               module.params['cache_dir'],
+                                               module.params['hostname'],
+                                               root)
+
+    missing = missing_objects(vcenter_objects, vcenter_mos)
+
+    if missing:
+        module.fail_json(msg="Failed to get MOID for: {}".format(', '.join(missing)))
+
+    object_ids = nest_by_vim_type(dict((key, mo._moId) for key, mo in vcenter_mos.items()))
+
+    paths_by_mo = {}
+    for item in vcenter_objects:
+        path_set = item.get('properties') or module.params['properties']
+        if path_set:
+            paths_by_mo.setdefault(vcenter_mos[(item['vcenter_vim_type'], item['vcenter_object_name'])],
+                                   set()).update(path_set)
+
+    if paths_by_mo:
+        try:
+            object_properties = get_obj_properties(content, paths_by_mo)
+        except VcenterQueryError as e:
+            module.fail_json(msg=str(e))
+        object_properties = nest_by_vim_type(dict((key, object_properties[mo])
+                                                  for key, mo in vcenter_mos.items() if mo in object_properties))
+        module.exit_json(changed=False, object_ids=object_ids, object_properties=object_properties,
+                         ansible_facts=dict(vcenter_object_ids=object_ids,
+                                            vcenter_object_properties=object_properties))
+
+    module.exit_json(changed=False, object_ids=object_ids,
+                     ansible_facts=dict(vcenter_object_ids=object_ids))
+
+
+def get_endpoints(module):
+    """
+    Return the connection settings of hostname followed by every vcenters
+    item, items inherit the settings they leave out from the module options
+    """
+    defaults = dict(hostname=module.params['hostname'],
+                    username=module.params['username'],
+                    password=module.params['password'],
+                    port=module.params.get('port') or 443,
+                    validate_certs=module.params['validate_certs'])
+
+    endpoints = [defaults]
+
+    for item in module.params['vcenters']:
+        if not isinstance(item, dict):
+            item = dict(hostname=item)
+        if not item.get('hostname'):
+            module.fail_json(msg="Each vcenters item requires hostname: {}".format(item))
+        endpoint = dict(defaults)
+        endpoint.update(item)
+        endpoints.append(endpoint)
+
+    return endpoints
+
+
+def query_endpoint(module, endpoint, vcenter_objects):
+    """
+    Resolve vcenter_objects on one vCenter over its own session. Returns the
+    moIds found and the names that are missing.
+    """
+    content = connect_to_endpoint(endpoint['hostname'],
+                                  endpoint['username'],
+                                  endpoint['password'],
+                                  endpoint['port'],
+                                  endpoint['validate_certs'],
+                                  module.params['session_cache_dir'])
+
+    root = resolve_scope_root(content,
+                              module.params['datacenter'],
+                              module.params['folder'],
+                              module.params['cluster'])
+
+    vcenter_mos = find_vcenter_objects_by_name(content, vcenter_objects,
+                                               module.params['cache_dir'],
+                                               endpoint['hostname'],
+                                               root)
+
+    return dict(object_ids=nest_by_vim_type(dict((key, mo._moId) for key, mo in vcenter_mos.items())),
+                missing=missing_objects(vcenter_objects, vcenter_mos))
+
+
+def query_vcenters(module):
+    """
+    Run the same lookups on every endpoint concurrently, one thread and one
+    session per vCenter
+    """
+    vcenter_objects = module.params['vcenter_objects']
+
+    if not vcenter_objects:
+        vcenter_objects = [dict(vcenter_object_name=module.params['vcenter_object_name'],
+                                vcenter_vim_type=module.params['vcenter_vim_type'])]
+
+    validate_vcenter_objects(module, vcenter_objects)
+
+    results = {}
+
+    def worker(endpoint):
+        try:
+            results[endpoint['hostname']] = query_endpoint(module, endpoint, vcenter_objects)
+        except Exception as e:
+            results[endpoint['hostname']] = dict(failed=True, msg=str(getattr(e, 'msg', None) or e))
+
+    threads = [threading.Thread(target=worker, args=(endpoint,)) for endpoint in get_endpoints(module)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    failed = sorted(h for h, r in results.items() if r.get('failed') or r.get('missing'))
+
+    if failed:
+        module.fail_json(msg="Failed to get MOIDs on: {}".format(', '.join(failed)), results=results)
+
+    object_ids = dict((h, r['object_ids']) for h, r in results.items())
+
+    module.exit_json(changed=False, results=object_ids,
+                     ansible_facts=dict(vcenter_query_results=object_ids))
+
+
 def main():
 
     argument_spec = vmware_argument_spec()
 
     argument_spec.update(
         dict(
-            vcenter_object_name=dict(type='str', required=True),
-            vcenter_vim_type=dict(type='str', required=True),
+            vcenter_object_name=dict(type='str'),
+            vcenter_vim_type=dict(type='str'),
+            vcenter_objects=dict(type='list'),
+            cache_dir=dict(type='path'),
+            session_cache_dir=dict(type='path'),
+            datacenter=dict(type='str'),
+            folder=dict(type='str'),
+            cluster=dict(type='str'),
+            inventory_path=dict(type='str'),
+            dns_name=dict(type='str'),
+            ip_address=dict(type='str'),
+            uuid=dict(type='str'),
+            vcenters=dict(type='list'),
+            match=dict(type='str', default='exact', choices=['exact', 'glob', 'regex']),
+            properties=dict(type='list'),
+            snapshot_dest=dict(type='path'),
+            snapshot_file=dict(type='path'),
+            tags=dict(type='list'),
+            custom_attributes=dict(type='dict'),
+            watch=dict(type='bool'),
         )
     )
 
-    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=False)
+    # watch is a bool, which AnsibleModule counts as given even when false,
+    # so it is checked against these after the argument spec
+    lookup_keys = ['vcenter_object_name', 'vcenter_objects', 'snapshot_dest', 'tags'] + SEARCH_INDEX_KEYS
+
+    module = AnsibleModule(argument_spec=argument_spec,
+                           mutually_exclusive=[lookup_keys,
+                                               ['snapshot_file', 'snapshot_dest'],
+                                               ['snapshot_file', 'vcenters'],
+                                               ['snapshot_file', 'properties']] +
+                                              [['snapshot_file', k] for k in SEARCH_INDEX_KEYS] +
+                                              [[scope, k] for scope in ('folder', 'cluster')
+                                               for k in SEARCH_INDEX_KEYS] +
+                                              [['custom_attributes', k] for k in lookup_keys if k != 'tags'] +
+                                              [['snapshot_file', 'tags'], ['snapshot_file', 'custom_attributes']] +
+                                              [['vcenters', k] for k in VCENTERS_EXCLUSIVE_KEYS],
+                           supports_check_mode=False)
+
+    if module.params['watch']:
+        conflicting = [k for k in lookup_keys + ['custom_attributes', 'snapshot_file', 'vcenters']
+                       if module.params[k]]
+        if conflicting:
+            module.fail_json(msg="parameters are mutually exclusive: watch|{}".format('|'.join(conflicting)))
+    elif not any(module.params[k] for k in lookup_keys + ['custom_attributes']):
+        module.fail_json(msg="one of the following is required: {}".format(
+            ', '.join(lookup_keys + ['custom_attributes', 'watch'])))
 
     if not HAS_PYVMOMI:
         module.fail_json(msg='pyvmomi is required for this module')
 
-    object_id = None
+    if module.params['snapshot_file']:
+        query_snapshot(module)
 
-    content = connect_to_api(module)
+    if module.params['vcenters']:
+        if not (module.params['vcenter_object_name'] or module.params['vcenter_objects']):
+            module.fail_json(msg="vcenters requires vcenter_object_name or vcenter_objects")
+        if module.params['match'] != 'exact':
+            module.fail_json(msg="vcenters only supports exact matches")
+        query_vcenters(module)
 
-    vcenter_mo = find_vcenter_object_by_name(content,
-                                             VIM_TYPE[module.params['vcenter_vim_type']],
-                                             module.params['vcenter_object_name'])
+    content = connect_to_vcenter(module)
+    root = get_scope_root(module, content)
 
-    if vcenter_mo:
-        object_id = vcenter_mo._moId
+    if module.params['snapshot_dest']:
+        query_export_snapshot(module, content, root)
+    elif module.params['watch']:
+        query_watch(module, content, root)
+    elif module.params['vcenter_objects']:
+        query_objects(module, content, root)
+    elif module.params['tags'] or module.params['custom_attributes']:
+        query_tagged(module, content, root)
+    elif not module.params['vcenter_object_name']:
+        query_search_index(module, content, root)
+    elif module.params['match'] != 'exact':
+        query_pattern(module, content, root)
     else:
-        module.fail_json(msg="Failed to get MOID for: {}".format(module.params['vcenter_object_name']))
-
-    module.exit_json(changed=False, object_id=object_id)
+        query_object(module, content, root)
 
 
 from ansible.module_utils.basic import *
+from ansible.module_utils.urls import open_url
 from ansible.module_utils.vmware import *
+from ansible.module_utils.vcenter_session import connect_to_vcenter, load_cached_session, save_session
+from ansible.module_utils.vcenter_index import (view_filter_spec, retrieve_object_contents, iter_obj_names,
+                                                build_inventory_index, find_names_by_pattern, load_index_cache,
+                                                save_index_cache, refresh_index, find_cached_objects_by_name)
 
 if __name__ == '__main__':
     main()
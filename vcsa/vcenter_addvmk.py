@@ -28,6 +28,9 @@ description:
 notes:
     requirements: ansible 2.x
     - Tested on vSphere 6.0
+    - In check mode nothing is changed, the add, update, select and deselect
+      operations each host needs are returned in plan keyed by host name.
+      The vnics and service types of all hosts are read in one call
 options:
     hostname:
         description:
@@ -44,7 +47,20 @@ options:
     esxi_hostname:
         description:
             - The hostname or ip of the esxi host to add the vmkernel adapter
-        required: True
+            - When neither esxi_hostname nor esxi_hostnames is given every
+              host of cluster is configured
+        required: False
+    esxi_hostnames:
+        description:
+            - List of esxi hosts to add the vmkernel adapter to concurrently
+              over one vCenter session, results are returned per host
+        required: False
+    ip_addresses:
+        description:
+            - Dict of esxi host name to ip address for the hosts of
+              esxi_hostnames or cluster, required for each host when dhcp is
+              False
+        required: False
     portgroup_name:
         description:
             - The name of the portgroup to add the vmkernel adapter to
@@ -88,6 +104,51 @@ options:
             type is managment
         choices: ['present', 'absent']
         required: True
+    task_timeout:
+        description:
+            - Seconds to wait for the vSAN network update task to complete
+              before failing, for all hosts together with esxi_hostnames or
+              cluster
+        type: int
+        required: False
+        default: 1800
+    max_workers:
+        description:
+            - Number of hosts configured at the same time with esxi_hostnames
+              or cluster
+        type: int
+        required: False
+        default: 8
+    max_failures:
+        description:
+            - Number of failed hosts tolerated with esxi_hostnames or cluster,
+              once exceeded the hosts not started yet are skipped and the
+              task fails. Tolerated failures are returned in results and
+              failed_hosts without failing the task
+            - With service_type vsan the vsan network update tasks of all
+              hosts are waited for together after the other changes, and
+              their failures are reported but not counted
+        type: int
+        required: False
+        default: 0
+    session_cache_dir:
+        description:
+            - Directory on the control node where the vCenter session cookie
+              is kept, readable by the current user only. Later runs reuse the
+              session while it is logged in instead of logging in again, and
+              the session is not logged out at exit
+        required: False
+        default: None
+    datacenter:
+        description:
+            - Name of the datacenter the host and portgroup lookups are limited to
+        required: False
+        default: None
+    cluster:
+        description:
+            - Name of the cluster the host lookup is limited to
+        required: False
+        default: None
 '''
 
 
@@ -110,11 +171,30 @@ EXAMPLE = '''
     - "{{ vcenter_host_pgs }}"
   tags:
     - addvmk
+
+- name: Add vmotion vmkernel adapter to every host of the cluster
+  vcenter_addvmk:
+    hostname: "{{ vcenter }}"
+    username: "{{ vcenter_user }}"
+    password: "{{ vcenter_password }}"
+    validate_certs: "{{ vcenter_validate_certs }}"
+    cluster: "{{ compute_cluster }}"
+    portgroup_name: "{{ vmotion_pg_name }}"
+    dhcp: False
+    ip_addresses: "{{ vmotion_ip_addresses }}"
+    subnet_mask: "{{ vmotion_subnet }}"
+    service_type: vmotion
+    max_workers: 16
+    max_failures: 2
+    state: present
+  tags:
+    - addvmk
 '''
 
 
 try:
     import atexit
+    import threading
     import time
     import requests
     from pyVim import connect
@@ -125,7 +205,12 @@ except ImportError:
     HAS_PYVMOMI = False
 
 
-vc = {}
+class TaskError(Exception):
+    pass
+
+
+class VmkError(Exception):
+    pass
 
 
 VALID_VMK_SERVICE_TYPES = [
@@ -145,6 +230,12 @@ def connect_to_vcenter(module, disconnect_atexit=True):
     username = module.params['login']
     password = module.params['password']
     port = module.params['port']
+    session_cache_dir = module.params['session_cache_dir']
+
+    if session_cache_dir:
+        service_instance = load_cached_session(session_cache_dir, hostname, username, port)
+        if service_instance:
+            return service_instance.RetrieveContent()
 
     try:
         service_instance = connect.SmartConnect(
@@ -154,7 +245,9 @@ def connect_to_vcenter(module, disconnect_atexit=True):
             port=port
         )
 
-        if disconnect_atexit:
+        if session_cache_dir:
+            save_session(session_cache_dir, hostname, username, port, service_instance._stub)
+        elif disconnect_atexit:
             atexit.register(connect.Disconnect, service_instance)
 
         return service_instance.RetrieveContent()
@@ -163,17 +256,17 @@ def connect_to_vcenter(module, disconnect_atexit=True):
     except requests.ConnectionError, connection_error:
         module.fail_json(msg="Unable to connect to vCenter or ESXi API on TCP/443.", apierror=str(connection_error))
 
-def find_hostsystem_by_name(content, host_name):
-    host = find_vcenter_object_by_name(content, vim.HostSystem, host_name)
+def find_hostsystem_by_name(content, host_name, root=None):
+    host = find_vcenter_object_by_name(content, vim.HostSystem, host_name, root)
     if(host != ""):
         return host
     else:
         print "Host not found"
         return None
 
-def find_vcenter_object_by_name(content, vimtype, object_name):
+def find_vcenter_object_by_name(content, vimtype, object_name, root=None):
 
-    vcenter_object = get_all_objs(content, [vimtype])
+    vcenter_object = get_all_objs(content, [vimtype], root)
 
     for k, v in vcenter_object.items():
         if v == object_name:
@@ -181,21 +274,45 @@ def find_vcenter_object_by_name(content, vimtype, object_name):
     else:
         return None
 
-def get_all_objs(content, vimtype):
+def get_all_objs(content, vimtype, root=None):
     obj = {}
-    container = content.viewManager.CreateContainerView(content.rootFolder, vimtype, True)
-    for managed_object_ref in container.view:
-        obj.update({managed_object_ref: managed_object_ref.name})
+    container = content.viewManager.CreateContainerView(root or content.rootFolder, vimtype, True)
+    try:
+        for managed_object_ref in container.view:
+            obj.update({managed_object_ref: managed_object_ref.name})
+    finally:
+        container.Destroy()
     return obj
 
-def get_host_vmk():
+def get_scope_roots(module, content):
+    """
+    Return the entities host and portgroup lookups are rooted at. Hosts are
+    searched under the cluster when one is given, portgroups under the
+    datacenter since networks are not children of a cluster.
+    """
+    datacenter = None
+    cluster = None
+
+    if module.params['datacenter']:
+        datacenter = find_vcenter_object_by_name(content, vim.Datacenter, module.params['datacenter'])
+        if not datacenter:
+            module.fail_json(msg="Datacenter: {} not found".format(module.params['datacenter']))
+
+    if module.params['cluster']:
+        cluster = find_vcenter_object_by_name(content, vim.ClusterComputeResource,
+                                              module.params['cluster'], datacenter)
+        if not cluster:
+            module.fail_json(msg="Cluster: {} not found".format(module.params['cluster']))
+
+    return cluster or datacenter, datacenter
+
+def get_host_vmk(vc):
 
     vmk = None
 
-    host = vc['host']
     portgroup_key = vc['portgroup_key']
 
-    vnics = [v for v in host.config.network.vnic if v.spec.distributedVirtualPort]
+    vnics = [v for v in vc['vnics'] if v.spec.distributedVirtualPort]
 
     if not vnics:
         return vmk
@@ -207,45 +324,75 @@ def get_host_vmk():
     return vmk
 
 
-def check_vmk_net_config(module, vmk):
+def check_vmk_net_config(params, vmk):
 
     state = False
 
     vmk_ip = vmk.spec.ip.ipAddress
     vmk_subnet = vmk.spec.ip.subnetMask
 
-    if not (vmk.spec.mtu == module.params['mtu']):
+    if not (vmk.spec.mtu == params['mtu']):
         return state
 
     dhcp = vmk.spec.ip.dhcp
 
-    if not (dhcp == module.params['dhcp']):
+    if not (dhcp == params['dhcp']):
         return state
 
-    if not module.params['dhcp']:
-        if (vmk_ip == module.params['ip_address']) and (vmk_subnet == module.params['subnet_mask']):
+    if not params['dhcp']:
+        if (vmk_ip == params['ip_address']) and (vmk_subnet == params['subnet_mask']):
             state = True
-    elif module.params['dhcp']:
+    elif params['dhcp']:
         state = True
 
     return state
 
 
-def _query_vmk_service_type(module, service_type):
+def retrieve_properties(content, mos, vimtype, path_set):
+    """
+    Return a dict of managed object to a dict of property path to value
+    for path_set of every object in mos, read in one RetrievePropertiesEx
+    call paged with ContinueRetrievePropertiesEx
+    """
+    object_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=mo, skip=False) for mo in mos]
+    property_spec = vmodl.query.PropertyCollector.PropertySpec(type=vimtype, pathSet=path_set)
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=object_specs, propSet=[property_spec])
+
+    collector = content.propertyCollector
+    obj = dict((mo, {}) for mo in mos)
+
+    result = collector.RetrievePropertiesEx([filter_spec], vmodl.query.PropertyCollector.RetrieveOptions())
+    while result:
+        for object_content in result.objects:
+            obj[object_content.obj].update(dict((p.name, p.val) for p in object_content.propSet))
+        if not result.token:
+            break
+        result = collector.ContinueRetrievePropertiesEx(result.token)
+
+    return obj
 
-    query_result = None
-    host = vc['host']
 
+def get_hosts_network(content, hosts):
+    """
+    Return a dict of host to a local copy of the network config the vmk
+    checks compare against: the vnics in 'vnics' and the VirtualNicManager
+    NetConfig per service type in 'net_config'. Both are read for all hosts
+    in one call, rather than through host.config, which fetches the whole
+    config of the host, and a QueryNetConfig per host and service type.
+    """
     try:
-        query_result = host.configManager.virtualNicManager.QueryNetConfig(service_type)
-    except vim.fault.HostConfigFault as config_fault:
-        module.fail_json(msg="Failed check vmk service type config fault: {}".format(str(config_fault)))
-    except vmodl.fault.InvalidArgument as invalid_arg:
-        module.fail_json(msg="Failed check vmk service type invalid arg: {}".format(str(invalid_arg)))
+        props = retrieve_properties(content, hosts, vim.HostSystem,
+                                    ['config.network.vnic', 'config.virtualNicManagerInfo.netConfig'])
     except Exception as e:
-        module.fail_json(msg="Failed check vmk service type: {}".format(str(e)))
+        raise VmkError("Failed to read host network config: {}".format(str(e)))
+
+    network = {}
+    for host, host_props in props.items():
+        net_config = host_props.get('config.virtualNicManagerInfo.netConfig') or []
+        network.update({host: dict(vnics=host_props.get('config.network.vnic') or [],
+                                   net_config=dict((c.nicType, c) for c in net_config))})
 
-    return query_result
+    return network
 
 
 def _get_list_vmk_with_servicetype(query_result):
@@ -260,16 +407,15 @@ def _get_list_vmk_with_servicetype(query_result):
     return vmks_with_servicetype
 
 
-def check_vmk_service_type(module):
+def check_vmk_service_type(vc, params):
 
     vmk = vc['vmk']
-    desired_service_type = module.params['service_type']
+    desired_service_type = params['service_type']
     servicetype_vmk = {}
 
     for service_type in VALID_VMK_SERVICE_TYPES:
-        if service_type:
-            query = _query_vmk_service_type(module, service_type)
-            vmk_list = _get_list_vmk_with_servicetype(query)
+        if service_type and service_type in vc['net_config']:
+            vmk_list = _get_list_vmk_with_servicetype(vc['net_config'][service_type])
             servicetype_vmk.update({service_type:vmk_list})
 
     vmk_servicetype_list = []
@@ -292,17 +438,17 @@ def check_vmk_service_type(module):
     return True, None
 
 
-def vmk_spec(module):
+def vmk_spec(vc, params):
 
     vdsuuid = vc['vds_uuid']
     portgroupKey = vc['portgroup_key']
-    dhcp = module.params['dhcp']
-    mtu = module.params['mtu']
+    dhcp = params['dhcp']
+    mtu = params['mtu']
 
     if not dhcp:
 
-        ipaddress = module.params['ip_address']
-        subnetMask = module.params['subnet_mask']
+        ipaddress = params['ip_address']
+        subnetMask = params['subnet_mask']
 
         ip_spec = vim.host.IpConfig(dhcp=False,
                                     ipAddress=ipaddress,
@@ -320,35 +466,35 @@ def vmk_spec(module):
     return nic_spec
 
 
-def add_vmk_to_host(module):
+def add_vmk_to_host(vc, params):
 
     vmkdevice = None
 
     host = vc['host']
-    vnic_spec = vmk_spec(module)
+    vnic_spec = vmk_spec(vc, params)
 
     try:
         vmkdevice = host.configManager.networkSystem.AddVirtualNic("", vnic_spec)
-    except vim.fault.AlreadyExists as present:
-        module.exit_json(changed=False, result=str(present))
+    except vim.fault.AlreadyExists:
+        raise
     except vim.fault.HostConfigFault as config_fault:
-        module.fail_json(msg="Failed adding vmk config issue: {}".format(str(config_fault)))
+        raise VmkError("Failed adding vmk config issue: {}".format(str(config_fault)))
     except vim.fault.InvalidState as invalid_state:
         fail_msg ="Failed adding vmk ipv6 address is specified in an ipv4 only system: {}".format(str(invalid_state))
-        module.fail_json(msg=fail_msg)
+        raise VmkError(fail_msg)
     except vmodl.fault.InvalidArgument as invalid_arg:
         fail_msg = "Failed adding vmk P address or subnet mask in the IP configuration are invalid" \
                    "or PortGroup does not exist".format(str(invalid_arg))
-        module.fail_json(msg=fail_msg)
+        raise VmkError(fail_msg)
     except Exception as e:
-        module.fail_json(msg="Failed adding vmk general error: {}".format(str(e)))
+        raise VmkError("Failed adding vmk general error: {}".format(str(e)))
 
     return vmkdevice
 
 
-def set_vmk_service_type(module, vmk):
+def set_vmk_service_type(vc, params, vmk):
     state = False
-    service_type = module.params['service_type']
+    service_type = params['service_type']
     host = vc['host']
 
     try:
@@ -358,9 +504,9 @@ def set_vmk_service_type(module, vmk):
         fail_msg = "Failed setting vmk service type" \
                    "nicType is invalid, or device represents" \
                    " a nonexistent or invalid VirtualNic: {}".format(str(invalid_arg))
-        module.fail_json(msg=fail_msg)
+        raise VmkError(fail_msg)
     except Exception as e:
-        module.fail_json(msg="Failed setting vmk service type: {}".format(str(e)))
+        raise VmkError("Failed setting vmk service type: {}".format(str(e)))
 
     return state
 
@@ -374,8 +520,12 @@ def vsan_spec(vmk):
     return vsan_config
 
 
-def set_vmk_service_type_vsan(module, vmk):
-
+def set_vmk_service_type_vsan(vc, params, vmk):
+    """
+    Update the vsan network of the host to vmk. When vc has a vsan_tasks
+    dict the task is added to it, keyed by host, for the caller to wait on
+    together with the tasks of other hosts, otherwise it is waited for here.
+    """
     changed = False
     result = None
 
@@ -386,56 +536,119 @@ def set_vmk_service_type_vsan(module, vmk):
 
     try:
         vsan_task = vsan_system.UpdateVsan_Task(vsan_config)
-        changed, result = wait_for_task(vsan_task)
+        if 'vsan_tasks' in vc:
+            vc['vsan_tasks'].update({host: vsan_task})
+            return True, vsan_task._moId
+        changed, result = wait_for_task(vc['si'], vsan_task, params['task_timeout'])
     except Exception as e:
-        module.fail_json(msg="Failed to set service type to vsan: {}".format(str(e)))
+        raise VmkError("Failed to set service type to vsan: {}".format(str(e)))
 
     return changed, result
 
-def wait_for_task(task):
-    while True:
-        if task.info.state == vim.TaskInfo.State.success:
-            return True, task.info.result
-        if task.info.state == vim.TaskInfo.State.error:
-            try:
-                raise Exception(task.info.error)
-            except AttributeError:
-                raise TaskError("An unknown error has occurred")
-        if task.info.state == vim.TaskInfo.State.running:
-            time.sleep(15)
-        if task.info.state == vim.TaskInfo.State.queued:
-            time.sleep(15)
 
-def state_create_vmk_host(module):
+def wait_for_tasks(content, tasks, timeout=None):
+    """
+    Wait for all tasks to complete and return a dict of task moId to a dict
+    of its info.state, info.error and info.result. Tasks still running
+    after timeout seconds are returned in the state they were last in.
+    State changes of every task are pushed by WaitForUpdatesEx on one
+    collector of their own, so this returns as soon as the last task
+    completes rather than on the next poll.
+    """
+    collector = content.propertyCollector.CreatePropertyCollector()
+
+    object_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=task, skip=False) for task in tasks]
+    property_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.Task,
+                                                               pathSet=['info.state', 'info.error', 'info.result'])
+    collector.CreateFilter(vmodl.query.PropertyCollector.FilterSpec(objectSet=object_specs,
+                                                                    propSet=[property_spec]),
+                           partialUpdates=False)
+
+    done = [vim.TaskInfo.State.success, vim.TaskInfo.State.error]
+    deadline = time.time() + timeout if timeout else None
+    version = ''
+    info = dict((task._moId, {}) for task in tasks)
+
+    try:
+        while not all(i.get('info.state') in done for i in info.values()):
+            options = vmodl.query.PropertyCollector.WaitOptions()
+            if deadline:
+                options.maxWaitSeconds = max(int(deadline - time.time()), 0)
+
+            update_set = collector.WaitForUpdatesEx(version, options)
+
+            if update_set is None:
+                break
+
+            version = update_set.version
+            for filter_update in update_set.filterSet:
+                for object_update in filter_update.objectSet:
+                    for change in object_update.changeSet:
+                        info[object_update.obj._moId].update({change.name: change.val})
+    finally:
+        collector.DestroyPropertyCollector()
+
+    return info
+
+
+def task_result(task, info, timeout=None):
+    """
+    Return (True, result) for a task completed successfully, raise
+    TaskError when it failed or did not complete within timeout seconds
+    """
+    if info.get('info.state') == vim.TaskInfo.State.success:
+        return True, info.get('info.result')
+
+    if info.get('info.state') == vim.TaskInfo.State.error:
+        error = info.get('info.error')
+        if error is None:
+            raise TaskError("An unknown error has occurred")
+        raise TaskError(error.msg)
+
+    raise TaskError("Task {} did not complete within {} seconds".format(task._moId, timeout))
+
+
+def wait_for_task(content, task, timeout=None):
+    """
+    Wait for task to complete and return (True, result), raise TaskError
+    when it fails or is not done within timeout seconds
+    """
+    return task_result(task, wait_for_tasks(content, [task], timeout)[task._moId], timeout)
+
+
+def state_create_vmk_host(vc, params):
 
     changed = False
     result = []
 
-    vmk_added = add_vmk_to_host(module)
+    try:
+        vmk_added = add_vmk_to_host(vc, params)
+    except vim.fault.AlreadyExists as present:
+        return dict(changed=False, result=str(present))
 
     if vmk_added:
         changed = True
         result.append(vmk_added)
 
-    if module.params['service_type'] == 'vsan':
-        set_servicetype_changed, set_servicetype_result = set_vmk_service_type_vsan(module, vmk_added)
+    if params['service_type'] == 'vsan':
+        set_servicetype_changed, set_servicetype_result = set_vmk_service_type_vsan(vc, params, vmk_added)
         changed = True
         result.append(set_servicetype_result)
-    elif module.params['service_type']:
-        set_servicetype = set_vmk_service_type(module, vmk_added)
+    elif params['service_type']:
+        set_servicetype = set_vmk_service_type(vc, params, vmk_added)
         result.append(set_servicetype)
 
-    module.exit_json(changed=changed, result=result)
+    return dict(changed=changed, result=result)
 
 
-def state_update_vmk_host(module):
+def state_update_vmk_host(vc, params):
 
     changed = False
     result = None
 
     host = vc['host']
     vmk = vc['vmk']
-    service_type = module.params['service_type']
+    service_type = params['service_type']
 
     if not vc['update_servicetype']:
 
@@ -444,73 +657,83 @@ def state_update_vmk_host(module):
             try:
                 host.configManager.virtualNicManager.DeselectVnicForNicType(i, vmk.device)
             except Exception as e:
-                module.fail_json(msg="Failed to deselect vmk: {} for service: {} error: {}".format(vmk.device, i, str(e)))
+                raise VmkError("Failed to deselect vmk: {} for service: {} error: {}".format(vmk.device, i, str(e)))
 
         if service_type == 'vsan':
-            changed, result = set_vmk_service_type_vsan(module, vmk.device)
+            changed, result = set_vmk_service_type_vsan(vc, params, vmk.device)
         elif service_type:
-            changed = set_vmk_service_type(module, vmk.device)
+            changed = set_vmk_service_type(vc, params, vmk.device)
             result = vmk.device
 
     if not vc['update_netconfig']:
 
-        spec = vmk_spec(module)
+        spec = vmk_spec(vc, params)
         try:
             host.configManager.networkSystem.UpdateVirtualNic(vmk.device, spec)
         except Exception as e:
-            module.fail_json(msg="Failed to update network config for vmk: {} error: {}".format(vmk.device, str(e)))
+            raise VmkError("Failed to update network config for vmk: {} error: {}".format(vmk.device, str(e)))
 
-    module.exit_json(changed=changed, result=result)
+    return dict(changed=changed, result=result)
 
 
-def state_delete_vmk_host(module):
-    module.exit_json(changed=False, msg="STATE DELETE")
+def state_delete_vmk_host(vc, params):
+    return dict(changed=False, msg="STATE DELETE")
 
 
-def state_exit_unchanged(module):
-    module.exit_json(changed=False, msg="EXIT UNCHANGED")
+def state_exit_unchanged(vc, params):
+    return dict(changed=False, msg="EXIT UNCHANGED")
 
 
-def check_vmk_host_state(module):
+VMK_HOST_STATES = {
+    'absent': {
+        'update': state_delete_vmk_host,
+        'present': state_delete_vmk_host,
+        'absent': state_exit_unchanged,
+    },
+    'present': {
+        'update': state_update_vmk_host,
+        'present': state_exit_unchanged,
+        'absent': state_create_vmk_host,
+    }
+}
 
-    state = 'absent'
 
-    esxi_hostname = module.params['esxi_hostname']
-    vmk_service_type = module.params['service_type']
+def get_portgroup(module, content, root=None):
+    """
+    Return the vc entries shared by every host: the session content and
+    the key and vds uuid of the portgroup
+    """
     portgroup_name = module.params['portgroup_name']
 
-    if vmk_service_type not in VALID_VMK_SERVICE_TYPES:
-        module.params['service_type'] = None
+    portgroup = find_vcenter_object_by_name(content, vim.dvs.DistributedVirtualPortgroup, portgroup_name, root)
 
-    #si = connect_to_api(module)
-    si = connect_to_vcenter(module)
-    vc['si'] = si
+    if not portgroup:
+        module.fail_json(msg="Could not find portgroup specified: {}".format(portgroup_name))
 
-    host = find_hostsystem_by_name(si, esxi_hostname)
+    config = portgroup.config
 
-    if host is None:
-        module.fail_json(msg="Esxi host: {} not found".format(esxi_hostname))
+    return dict(si=content,
+                portgroup=portgroup,
+                portgroup_key=config.key,
+                vds_uuid=config.distributedVirtualSwitch.uuid)
 
-    vc['host'] = host
 
-    portgroup = find_vcenter_object_by_name(si, vim.dvs.DistributedVirtualPortgroup, portgroup_name)
+def check_vmk_host_state(vc, params):
 
-    if not portgroup:
-        module.fail_json(msg="Could not find portgroup specified: {}".format(portgroup_name))
+    state = 'absent'
 
-    vc['portgroup'] = portgroup
-    vc['portgroup_key'] = portgroup.config.key
-    vc['vds_uuid'] = portgroup.config.distributedVirtualSwitch.uuid
+    if 'vnics' not in vc:
+        vc.update(get_hosts_network(vc['si'], [vc['host']])[vc['host']])
 
-    vmk = get_host_vmk()
+    vmk = get_host_vmk(vc)
 
     if not vmk:
         return state
 
     vc['vmk'] = vmk
 
-    vmk_net_config = check_vmk_net_config(module, vmk)
-    service_type_check, unset_list = check_vmk_service_type(module)
+    vmk_net_config = check_vmk_net_config(params, vmk)
+    service_type_check, unset_list = check_vmk_service_type(vc, params)
 
     vc['unset_list'] = unset_list
 
@@ -526,6 +749,216 @@ def check_vmk_host_state(module):
     return state
 
 
+def configure_vmk_host(vc, params):
+    return VMK_HOST_STATES[params['state']][check_vmk_host_state(vc, params)](vc, params)
+
+
+def _net_config_summary(ip_address, subnet_mask, dhcp, mtu):
+    return dict(ip_address=ip_address, subnet_mask=subnet_mask, dhcp=dhcp, mtu=mtu)
+
+
+def plan_vmk_host(vc, params):
+    """
+    Return the operations configure_vmk_host would run on the host, in
+    order, without running them
+    """
+    operations = []
+
+    state = check_vmk_host_state(vc, params)
+    service_type = params['service_type']
+
+    desired = _net_config_summary(None if params['dhcp'] else params['ip_address'],
+                                  None if params['dhcp'] else params['subnet_mask'],
+                                  params['dhcp'], params['mtu'])
+
+    if params['state'] != 'present' or state == 'present':
+        return operations
+
+    if state == 'absent':
+        operations.append(dict(operation='add', portgroup=params['portgroup_name'], config=desired))
+        if service_type:
+            operations.append(dict(operation='select', service_type=service_type))
+        return operations
+
+    vmk = vc['vmk']
+
+    if not vc['update_servicetype']:
+        for i in vc['unset_list']:
+            operations.append(dict(operation='deselect', device=vmk.device, service_type=i))
+        if service_type:
+            operations.append(dict(operation='select', device=vmk.device, service_type=service_type))
+
+    if not vc['update_netconfig']:
+        current = _net_config_summary(vmk.spec.ip.ipAddress, vmk.spec.ip.subnetMask,
+                                      vmk.spec.ip.dhcp, vmk.spec.mtu)
+        operations.append(dict(operation='update', device=vmk.device, before=current, after=desired))
+
+    return operations
+
+
+def plan_vmk_hosts(module, shared_vc, hosts):
+    """
+    Return a dict of host name to its planned operations, computed from the
+    network config of all hosts read in one call
+    """
+    network = get_hosts_network(shared_vc['si'], list(hosts.values()))
+
+    plan = {}
+    for esxi_hostname, host in hosts.items():
+        vc = dict(shared_vc, host=host, **network[host])
+        plan.update({esxi_hostname: plan_vmk_host(vc, host_params(module, esxi_hostname))})
+
+    return plan
+
+
+def get_rollout_hosts(module, content, host_root):
+    """
+    Return a dict of host name to HostSystem for esxi_hostnames, or for
+    every host of the cluster when no names are given, from one scan
+    """
+    hosts = dict((v, k) for k, v in get_all_objs(content, [vim.HostSystem], host_root).items())
+
+    esxi_hostnames = module.params['esxi_hostnames']
+
+    if not esxi_hostnames:
+        return hosts
+
+    missing = [h for h in esxi_hostnames if h not in hosts]
+
+    if missing:
+        module.fail_json(msg="Esxi hosts not found: {}".format(', '.join(missing)))
+
+    return dict((h, hosts[h]) for h in esxi_hostnames)
+
+
+def host_params(module, esxi_hostname):
+    """
+    Return the module params for one host of a rollout, with its address
+    taken from ip_addresses
+    """
+    params = dict(module.params, esxi_hostname=esxi_hostname)
+    ip_addresses = module.params['ip_addresses'] or {}
+
+    if esxi_hostname in ip_addresses:
+        params['ip_address'] = ip_addresses[esxi_hostname]
+
+    return params
+
+
+def rollout_vmk_hosts(module, shared_vc, hosts):
+    """
+    Configure hosts concurrently over the session of shared_vc, at most
+    max_workers at a time. Once more than max_failures hosts have failed
+    the hosts not started yet are skipped. Returns a dict of host name
+    to its result.
+    """
+    network = get_hosts_network(shared_vc['si'], list(hosts.values()))
+
+    # vsan network updates are submitted by the workers and waited for
+    # together once they are done
+    vsan_tasks = {}
+
+    pending = sorted(hosts)
+    results = {}
+    failures = [0]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                esxi_hostname = pending.pop(0)
+                if failures[0] > module.params['max_failures']:
+                    results[esxi_hostname] = dict(changed=False, skipped=True,
+                                                  msg="Skipped, failure budget exhausted")
+                    continue
+
+            vc = dict(shared_vc, host=hosts[esxi_hostname], vsan_tasks=vsan_tasks,
+                      **network[hosts[esxi_hostname]])
+
+            try:
+                result = configure_vmk_host(vc, host_params(module, esxi_hostname))
+            except Exception as e:
+                result = dict(changed=False, failed=True, msg=str(getattr(e, 'msg', None) or e))
+                with lock:
+                    failures[0] += 1
+
+            with lock:
+                results[esxi_hostname] = result
+
+    threads = [threading.Thread(target=worker) for _ in range(min(module.params['max_workers'], len(hosts)))]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if vsan_tasks:
+        task_info = wait_for_tasks(shared_vc['si'], list(vsan_tasks.values()), module.params['task_timeout'])
+
+        for esxi_hostname, host in hosts.items():
+            if host not in vsan_tasks:
+                continue
+            task = vsan_tasks[host]
+            try:
+                task_result(task, task_info[task._moId], module.params['task_timeout'])
+            except TaskError as e:
+                results[esxi_hostname] = dict(changed=True, failed=True,
+                                              msg="Failed to set service type to vsan: {}".format(str(e)))
+
+    return results
+
+
+def state_rollout(module, content, host_root, portgroup_root):
+
+    hosts = get_rollout_hosts(module, content, host_root)
+
+    if not hosts:
+        module.fail_json(msg="No esxi hosts found")
+
+    if not module.params['dhcp'] and module.params['state'] == 'present':
+        ip_addresses = module.params['ip_addresses'] or {}
+        missing = sorted(h for h in hosts if h not in ip_addresses)
+        if missing:
+            module.fail_json(msg="ip_addresses has no address for: {}".format(', '.join(missing)))
+
+    if module.check_mode:
+        plan = plan_vmk_hosts(module, get_portgroup(module, content, portgroup_root), hosts)
+        module.exit_json(changed=any(plan.values()), plan=plan)
+
+    results = rollout_vmk_hosts(module, get_portgroup(module, content, portgroup_root), hosts)
+
+    changed = any(r.get('changed') for r in results.values())
+    failed = sorted(h for h, r in results.items() if r.get('failed'))
+    skipped = sorted(h for h, r in results.items() if r.get('skipped'))
+
+    if len(failed) > module.params['max_failures'] or skipped:
+        module.fail_json(msg="Failed to configure vmk on: {}".format(', '.join(failed)),
+                         changed=changed, results=results, failed_hosts=failed, skipped=skipped)
+
+    module.exit_json(changed=changed, results=results, failed_hosts=failed)
+
+
+def state_single_host(module, content, host_root, portgroup_root):
+
+    esxi_hostname = module.params['esxi_hostname']
+
+    host = find_hostsystem_by_name(content, esxi_hostname, host_root)
+
+    if host is None:
+        module.fail_json(msg="Esxi host: {} not found".format(esxi_hostname))
+
+    vc = get_portgroup(module, content, portgroup_root)
+    vc['host'] = host
+
+    if module.check_mode:
+        plan = plan_vmk_host(vc, module.params)
+        module.exit_json(changed=bool(plan), plan={esxi_hostname: plan})
+
+    module.exit_json(**configure_vmk_host(vc, module.params))
+
+
 def main():
     #argument_spec = vmware_argument_spec()
 
@@ -534,36 +967,53 @@ def main():
             login=dict(required=True, type='str'),
             password=dict(required=True, type='str'),
             port=dict(required=True, type='int'),
-            esxi_hostname=dict(required=True, type='str'),
+            esxi_hostname=dict(required=False, type='str'),
+            esxi_hostnames=dict(required=False, type='list'),
             portgroup_name=dict(required=True, type='str'),
             dhcp=dict(required=True, type='bool'),
             ip_address=dict(required=False, type='str'),
+            ip_addresses=dict(required=False, type='dict'),
             subnet_mask=dict(required=False, type='str'),
             service_type=dict(default=None, required=False, type='str'),
             mtu=dict(required=False, type='int', default=1500),
-            state=dict(default='present', choices=['present', 'absent'], type='str'))
+            state=dict(default='present', choices=['present', 'absent'], type='str'),
+            session_cache_dir=dict(required=False, type='path'),
+            task_timeout=dict(required=False, type='int', default=1800),
+            max_workers=dict(required=False, type='int', default=8),
+            max_failures=dict(required=False, type='int', default=0),
+            datacenter=dict(required=False, type='str'),
+            cluster=dict(required=False, type='str'))
 
 
-    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=False)
+    module = AnsibleModule(argument_spec=argument_spec,
+                           mutually_exclusive=[['esxi_hostname', 'esxi_hostnames'],
+                                               ['esxi_hostname', 'ip_addresses']],
+                           supports_check_mode=True)
 
     if not HAS_PYVMOMI:
         module.fail_json(msg='pyvmomi is required for this module')
 
+    rollout = module.params['esxi_hostnames'] or not module.params['esxi_hostname']
+
+    if rollout and not (module.params['esxi_hostnames'] or module.params['cluster']):
+        module.fail_json(msg="One of esxi_hostname, esxi_hostnames or cluster is required")
+
+    if module.params['max_workers'] < 1:
+        module.fail_json(msg="max_workers must be at least 1")
+
+    if module.params['service_type'] not in VALID_VMK_SERVICE_TYPES:
+        module.params['service_type'] = None
+
     try:
-        vmk_host_states = {
-            'absent': {
-                'update': state_delete_vmk_host,
-                'present': state_delete_vmk_host,
-                'absent': state_exit_unchanged,
-            },
-            'present': {
-                'update': state_update_vmk_host,
-                'present': state_exit_unchanged,
-                'absent': state_create_vmk_host,
-            }
-        }
-
-        vmk_host_states[module.params['state']][check_vmk_host_state(module)](module)
+        #si = connect_to_api(module)
+        si = connect_to_vcenter(module)
+
+        host_root, portgroup_root = get_scope_roots(module, si)
+
+        if rollout:
+            state_rollout(module, si, host_root, portgroup_root)
+
+        state_single_host(module, si, host_root, portgroup_root)
 
     except vmodl.RuntimeFault as runtime_fault:
         module.fail_json(msg=runtime_fault.msg)
@@ -574,7 +1024,8 @@ def main():
 
 
 from ansible.module_utils.basic import *
+from ansible.module_utils.vcenter_session import load_cached_session, save_session
 #from ansible.module_utils.vmware import *
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
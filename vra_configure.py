@@ -10,6 +10,7 @@ import sys
 import base64
 import ssl
 import sys
+import threading
 import xml.etree.ElementTree as ET
 import xml.dom.minidom as minidom
 
@@ -56,6 +57,34 @@ options:
             - clustering information such as leading node, admin user, password
         required: false
         default: Nulll
+   vra_settings
+        description:
+            - desired config page settings by id, e.g. sso.host, license.key,
+              cafe.host, ssl.commonName, ntp.host1, db.*, messaging.* or
+              cluster.*. Applied after vra_postgres_db, vra_messaging and
+              vra_cluster, which are turned into db.*, messaging.* and
+              cluster.* settings
+            - the current values of all settings are read in one concurrent
+              batch and only the requests with a differing setting are
+              submitted, each with the settings given for it and the current
+              values of the rest of its page
+            - license.key is compared with the part of the key the appliance
+              shows back as license.vcac.status.key
+            - the per setting before and after values are returned in settings,
+              check mode reports them without submitting anything
+            - settings whose page query fails or does not answer with a
+              success statusCode are not submitted, they are marked
+              unreadable in settings and listed in unreadable
+        required: false
+        default: Nulll
+    update_password:
+        description:
+            - passwords can not be read back. on_change only sends them along
+              with another change of the same request, always submits every
+              request with a password setting
+        required: false
+        default: on_change
+        choices: ['always', 'on_change']
 '''
 EXAMPLES = '''
 
@@ -82,35 +111,73 @@ EXAMPLES = '''
       user: "{{vra_cluster_user}}"
       password: "{{vra_cluster_password}}"
 
+- name: vra_configure sso and license
+  vra_configure:
+    vra_instance: "{{vra_instance}}"
+    vra_port: "{{vra_port}}"
+    vra_user: "{{vra_user}}"
+    vra_root_password: "{{vra_root_password}}"
+    vra_settings:
+      sso.host: "{{vra_sso_host}}"
+      sso.port: "{{vra_sso_port}}"
+      sso.tenant: vsphere.local
+      sso.admin: "{{vra_sso_user}}"
+      sso.password: "{{vra_sso_password}}"
+      license.key: "{{vra_license_key}}"
+
 '''
 
+# (setting id prefix, query requestid, submit requestid, config page) of the
+# settings vra_settings manages. The appliance does not document the query
+# requestids, so a release naming them differently only needs a change here.
+CONFIG_PAGE_REQUESTS = [
+    ('sso.', 'ssoInfo', 'ssoUpdate', '/service/cafe/config-page.py'),
+    ('license.', 'licenseInfo', 'licenseUpdate', '/service/cafe/config-page.py'),
+    ('cafe.host', 'serverInfo', 'serverUpdate', '/service/cafe/config-page.py'),
+    ('host.', 'serverInfo', 'serverUpdate', '/service/cafe/config-page.py'),
+    ('ssl.', 'serverInfo', 'serverUpdate', '/service/cafe/config-page.py'),
+    ('ntp.', 'ntpInfo', 'ntpUpdate', '/service/administration/config-page.py'),
+    ('db.', 'dbInfo', 'dbUpdate', '/service/cafe/config-page.py'),
+    ('messaging.', 'messagingInfo', 'messagingUpdate', '/service/cafe/config-page.py'),
+    ('cluster.', 'clusterInfo', 'clusterJoin', '/service/cafe/config-page.py'),
+]
+
+# settings the appliance does not return, they are sent along with a submit
+# and only make one on their own with update_password=always
+WRITE_ONLY_SETTINGS = ('password', 'passphrase')
+
+# statusCode of a config-page query that returned the current values, an
+# unknown requestid or a failed query answers with another one
+CONFIG_PAGE_SUCCESS = 'success'
+
+# settings the appliance returns under another id, and only a part of: the
+# setting is unchanged when its current value is contained in the desired one
+READ_BACK_SETTINGS = {'license.key': 'license.vcac.status.key'}
+
+
 class VRA(object):
     def __init__(self, module):
         self.module = module
+        self.update_password = module.params.get('update_password')
 
     def get_vra(self, instance, port):
         #https://blr-3rd-4-dhcp102.eng.vmware.com:5480/#core.Login
-        conn = httplib.HTTPSConnection(instance, port)
         headers = {"Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8", "Cache-Control": "no-cache"}
-        conn.request('GET', "/#core.Login", "", headers)
-        response = conn.getresponse()
-        conn.close()
-        return response.status == 200 and response.reason == 'OK'
+        status, reason, body = vami_pool.request(instance, port, 'GET', "/#core.Login", "", headers)
+        return status == 200 and reason == 'OK'
 
     def get_vra_auth_token(self, instance, user, password, port):
         token = None
-        conn = httplib.HTTPSConnection(instance, port)
         credential_string = user+":"  + password
         credential_string_bytes = credential_string.encode()
         encoded_creds = base64.encodestring(credential_string_bytes).decode().replace('\n','')
         headers = {"Authorization": "Basic " + encoded_creds, "Accept": "text/html, text/xml, application/xml", "Cache-Control": "no-cache", "Accept-Encoding": "gzip, deflate", "Accept-Language": "en-US,en;q=0.8,pt;q=0.6", "Connection":"keep-alive", "Content-type":"application/xml; charset=\"UTF-8\""}
         request_payload = """<?xml version="1.0" encoding="UTF-8"?>
     <CIM CIMVERSION="2.0" DTDVERSION="2.0"><MESSAGE ID="5" PROTOCOLVERSION="1.0"><SIMPLEREQ><METHODCALL NAME="CreateSessionToken"><LOCALCLASSPATH><LOCALNAMESPACEPATH><NAMESPACE NAME="root"/><NAMESPACE NAME="cimv2"/></LOCALNAMESPACEPATH><CLASSNAME NAME="VAMI_Authentication"/></LOCALCLASSPATH></METHODCALL></SIMPLEREQ></MESSAGE></CIM>"""
-        conn.request('POST', "/cimom", request_payload, headers)
-        response = conn.getresponse()
-        status = response.status
-        if ( status == 200 and response.reason == 'OK'):
-            xmlResponse = response.read().decode(encoding='UTF-8')
+        status, reason, body = vami_pool.request(instance, port, 'POST', "/cimom", request_payload, headers,
+                                                 idempotent=True)
+        if ( status == 200 and reason == 'OK'):
+            xmlResponse = body.decode(encoding='UTF-8')
             lines = xmlResponse.splitlines()
             for line in lines:
                 if '<VALUE>' in line:
@@ -121,149 +188,173 @@ class VRA(object):
                         break
         else:
             print("Error code: " + str(status))
-        conn.close()
         return token
 
-    def configure_cluster(self, instance, user, token, host, admin_user, password):
-        conn = httplib.HTTPSConnection(instance, 5480)
+    def auth_headers(self, user, token):
         credential_string = user+":" + token
-        credential_string_bytes = credential_string.encode()
-        encoded_creds = base64.encodestring(credential_string_bytes).decode().replace('\n','')
-        headers = {"Authorization": "Basic " + encoded_creds, "Accept": "text/html, text/xml, application/xml", "Cache-Control": "no-cache", "Accept-Encoding": "gzip, deflate", "Accept-Language": "en-US,en;q=0.8,pt;q=0.6", "Connection":"keep-alive", "Content-type":"application/xml; charset=\"UTF-8\""}
-        request_payload = """<?xml version="1.0" encoding="utf-8"?>
-                        <request>
-                        <locale>en-US</locale>
-                        <action>submit</action>
-                        <requestid>clusterJoin</requestid>
-                        <value id="cluster.host">host</value>
-                        <value id="cluster.admin">root</value>
-                        <value id="cluster.password">VMware1!</value>
-                        </request>"""
-        root = ET.fromstring(request_payload)
-        for value in root.findall('value'):
-            if 'id' in value.attrib:
-                if value.get('id') == 'cluster.host':
-                    value.text = host
-                elif value.get('id')=='cluster.admin':
-                    value.text = admin_user
-                elif value.get('id')=='cluster.password':
-                    value.text = password
-        request_payload = ET.tostring(root, encoding='us-ascii', method='xml')
-        conn.request('POST', "/service/cafe/config-page.py", request_payload, headers)
-        response = conn.getresponse()
-        status = response.status
-        reason = response.reason
-        xml_response = response.read().decode(encoding='us-ascii')
-        root = ET.fromstring(xml_response)
-        for status_code in root.findall('status/statusCode'):
-            if(status_code.text == "confirm"):
-                conn.request('POST', "/service/cafe/config-page.py?confirmed=true", request_payload, headers)
-                response = conn.getresponse()
-                status = response.status
-                reason = response.reason
-                xml_response = response.read().decode(encoding='us-ascii')
-                conn.close()
-                if ( status == 200 and reason == 'OK'):
-
-                    return True, str(status) + reason + xml_response
-                else:
-                    print("Error code: " + status)
-                return False, str(status)+reason+xml_response
+        encoded_creds = base64.encodestring(credential_string.encode()).decode().replace('\n','')
+        return {"Authorization": "Basic " + encoded_creds, "Accept": "text/html, text/xml, application/xml", "Cache-Control": "no-cache", "Connection":"keep-alive", "Content-type":"application/xml; charset=\"UTF-8\""}
+
+    def config_page_request(self, action, requestid, values=None):
+        root = ET.Element('request')
+        ET.SubElement(root, 'locale').text = 'en-US'
+        ET.SubElement(root, 'action').text = action
+        ET.SubElement(root, 'requestid').text = requestid
+        for id in sorted(values or {}):
+            ET.SubElement(root, 'value', id=id).text = values[id]
+        return ET.tostring(root, encoding='us-ascii', method='xml')
+
+    def query_config_pages(self, instance, user, token, requests):
+        """
+        Read several config-page queries at the same time, one thread and
+        pooled connection each. requests is a list of (requestid, url), the
+        result a dict of requestid to its id to value dict, None for the
+        queries that failed or did not answer with a success statusCode.
+        """
+        headers = self.auth_headers(user, token)
+        results = {}
+
+        def worker(requestid, url):
+            action = CONFIG_PAGE_READ_ACTIONS.get(requestid, 'query')
+            try:
+                status, reason, body = vami_pool.request(instance, 5480, 'POST', url,
+                                                         self.config_page_request(action, requestid), headers,
+                                                         idempotent=True)
+                status_code, values = parse_config_page(body) if status == 200 else (None, None)
+                results[requestid] = values if status_code == CONFIG_PAGE_SUCCESS else None
+            except Exception:
+                results[requestid] = None
+
+        threads = [threading.Thread(target=worker, args=request) for request in requests]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def submit_config_page(self, instance, user, token, requestid, url, values):
+        """
+        Submit values with requestid, confirming the submit when the
+        appliance asks for it. Returns (success, response).
+        """
+        headers = self.auth_headers(user, token)
+        request_payload = self.config_page_request('submit', requestid, values)
+
+        status, reason, body = vami_pool.request(instance, 5480, 'POST', url, request_payload, headers)
+        if status == 200 and parse_config_page(body)[0] == "confirm":
+            status, reason, body = vami_pool.request(instance, 5480, 'POST', url + "?confirmed=true",
+                                                     request_payload, headers)
+
+        return status == 200 and reason == 'OK', str(status) + reason + body.decode(encoding='us-ascii')
+
+    def diff_config(self, desired, current):
+        """
+        Return a dict of setting id to its before and after values and
+        whether it differs. current is None when the page could not be read,
+        its settings are then marked unreadable and never differ. Write-only
+        settings only differ with update_password=always.
+        """
+        diff = {}
+        for id, value in desired.items():
+            if current is None:
+                diff[id] = dict(before=None, after=None if is_write_only(id) else value,
+                                changed=False, unreadable=True)
+                continue
+            if is_write_only(id):
+                diff[id] = dict(before=None, after=None, changed=self.update_password == 'always')
+                continue
+            before = current.get(READ_BACK_SETTINGS.get(id, id))
+            if id in READ_BACK_SETTINGS:
+                changed = not before or before not in value
             else:
-               return False,xmlResponse
-        conn.close()
+                changed = before != value
+            diff[id] = dict(before=before, after=value, changed=changed)
+        return diff
 
-    def configure_messaging(self, instance, user, token, host, port, messaging_user, password):
-        conn = httplib.HTTPSConnection(instance, 5480)
-        credential_string = user+":" + token
-        credential_string_bytes = credential_string.encode()
-        encoded_creds = base64.encodestring(credential_string_bytes).decode().replace('\n','')
-        headers = {"Authorization": "Basic " + encoded_creds, "Accept": "text/html, text/xml, application/xml", "Cache-Control": "no-cache", "Accept-Encoding": "gzip, deflate", "Accept-Language": "en-US,en;q=0.8,pt;q=0.6", "Connection":"keep-alive", "Content-type":"application/xml; charset=\"UTF-8\""}
-        request_payload = """<?xml version="1.0" encoding="utf-8"?>
-                        <request>
-                        <locale>en-US</locale>
-                        <action>submit</action>
-                        <requestid>messagingUpdate</requestid>
-                        <value id="messaging.host">127.0.0.1</value>
-                        <value id="messaging.port">5433</value>
-                        <value id="messaging.user">vcac</value>
-                        <value id="messaging.password"></value>
-                        </request>"""
-        root = ET.fromstring(request_payload)
-        for value in root.findall('value'):
-            if 'id' in value.attrib:
-                if value.get('id') == 'messaging.host':
-                    value.text = host
-                elif value.get('id')=='messaging.port':
-                    value.text = str(port)
-                elif value.get('id')=='messaging.user':
-                    value.text = messaging_user
-                elif value.get('id')=='messaging.password':
-                    value.text = password
-        request_payload = ET.tostring(root, encoding='us-ascii', method='xml')
-        conn.request('POST', "/service/cafe/config-page.py", request_payload, headers)
-        response = conn.getresponse()
-        status = response.status
-        reason = response.reason
-        xml_response = response.read().decode(encoding='us-ascii')
-        conn.close()
-        if ( status == 200 and reason == 'OK'):
-            return True, xml_response
-        else:
-            print("Error code: " + status)
-            return False, xml_response
+    def apply_config(self, instance, user, token, settings, check_mode=False):
+        """
+        Bring the config-page settings to the desired values. The current
+        values of every request involved are read in one concurrent batch,
+        and only the submit requestids with a differing setting are sent.
+        Pages that could not be read are not submitted.
+        Returns (changed, per setting diff, submit failures).
+        """
+        desired = {}
+        for id, value in settings.items():
+            if isinstance(value, bool):
+                value = 'true' if value else 'false'
+            desired[id] = "" if value is None else str(value)
 
-    def configure_postgresdb(self, instance, user, token, host, port, database, db_user, password):
-        conn = httplib.HTTPSConnection(instance, 5480)
-        credential_string = user+":" + token
-        credential_string_bytes = credential_string.encode()
-        encoded_creds = base64.encodestring(credential_string_bytes).decode().replace('\n','')
-        headers = {"Authorization": "Basic " + encoded_creds, "Accept": "text/html, text/xml, application/xml", "Cache-Control": "no-cache", "Accept-Encoding": "gzip, deflate", "Accept-Language": "en-US,en;q=0.8,pt;q=0.6", "Connection":"keep-alive", "Content-type":"application/xml; charset=\"UTF-8\""}
-        request_payload = """<?xml version="1.0" encoding="utf-8"?>
-                        <request>
-                        <locale>en-US</locale>
-                        <action>submit</action>
-                        <requestid>dbUpdate</requestid>
-                        <value id="db.host">127.0.0.1</value>
-                        <value id="db.port">5433</value>
-                        <value id="db.database">vcac</value>
-                        <value id="db.user">vcac</value>
-                        <value id="db.password"></value>
-                        </request>"""
-        root = ET.fromstring(request_payload)
-        for value in root.findall('value'):
-            if 'id' in value.attrib:
-                if value.get('id') == 'db.host':
-                    value.text = host
-                elif value.get('id')=='db.port':
-                    value.text = str(port)
-                elif value.get('id')=='db.database':
-                    value.text = database
-                elif value.get('id')=='db.user':
-                    value.text = db_user
-                elif value.get('id')=='db.password':
-                    value.text = password
-        request_payload = ET.tostring(root, encoding='us-ascii', method='xml')
-        conn.request('POST', "/service/cafe/config-page.py", request_payload, headers)
-        response = conn.getresponse()
-        status = response.status
-        reason = response.reason
-        xml_response = response.read().decode(encoding='us-ascii')
-        conn.close()
-        if ( status == 200 and reason == 'OK'):
-            return True, xml_response
-        else:
-            print("Error code: " + status)
-            return False, xml_response
+        requests = {}
+        for id in desired:
+            for prefix, query_requestid, submit_requestid, url in CONFIG_PAGE_REQUESTS:
+                if id.startswith(prefix):
+                    requests.setdefault((query_requestid, submit_requestid, url), {})[id] = desired[id]
+                    break
+            else:
+                raise ValueError("No config page request known for setting " + id)
+
+        current = self.query_config_pages(instance, user, token,
+                                          sorted(set((r[0], r[2]) for r in requests)))
+
+        changed = False
+        diff = {}
+        failures = {}
+        for (query_requestid, submit_requestid, url), values in sorted(requests.items()):
+            request_diff = self.diff_config(values, current.get(query_requestid))
+            diff.update(request_diff)
+            if not any(d['changed'] for d in request_diff.values()):
+                continue
+            changed = True
+            if check_mode:
+                continue
+            # the page is submitted whole, the settings not given keep the
+            # values it returned
+            submit_values = dict((id, value) for id, value in current[query_requestid].items()
+                                 if not is_write_only(id) and id not in READ_BACK_SETTINGS.values())
+            submit_values.update(values)
+            success, response = self.submit_config_page(instance, user, token, submit_requestid, url,
+                                                        submit_values)
+            if not success:
+                failures[submit_requestid] = response
+
+        return changed, diff, failures
+
+def is_write_only(id):
+    return any(w in id for w in WRITE_ONLY_SETTINGS)
+
+def desired_settings(module):
+    """
+    Return the config-page setting ids and values wanted, from
+    vra_postgres_db, vra_messaging and vra_cluster and then vra_settings
+    """
+    vra_postgres_db = module.params.get("vra_postgres_db")
+    vra_messaging = module.params.get("vra_messaging")
+    vra_cluster = module.params.get("vra_cluster")
+
+    settings = {}
+    if (vra_postgres_db is not None):
+        settings.update({'db.host': vra_postgres_db['host'], 'db.port': vra_postgres_db['port'],
+                         'db.database': vra_postgres_db['database'], 'db.user': vra_postgres_db['user'],
+                         'db.password': vra_postgres_db['password']})
+    if (vra_messaging is not None):
+        settings.update({'messaging.host': vra_messaging['host'], 'messaging.port': vra_messaging['port'],
+                         'messaging.user': vra_messaging['user'], 'messaging.password': vra_messaging['password']})
+    if (vra_cluster is not None):
+        settings.update({'cluster.host': vra_cluster['host'], 'cluster.admin': vra_cluster['user'],
+                         'cluster.password': vra_cluster['password']})
+
+    settings.update(module.params.get("vra_settings") or {})
+
+    return settings
 
 def core(module):
     vra_instance = module.params.get("vra_instance")
     vra_user = module.params.get("vra_user")
     vra_port = module.params.get("vra_port")
     vra_root_password = module.params.get("vra_root_password")
-    vra_postgres_db = module.params.get("vra_postgres_db")
-    vra_messaging = module.params.get("vra_messaging")
-    vra_cluster = module.params.get("vra_cluster")
 
     try:
         token=''
@@ -271,18 +362,20 @@ def core(module):
         if (vra.get_vra(vra_instance,vra_port)):
             token = vra.get_vra_auth_token(vra_instance, vra_user, vra_root_password,vra_port)
             if(token != None):
-                if (vra_postgres_db is not None):
-                    status, message = vra.configure_postgresdb(vra_instance, vra_user, token, vra_postgres_db['host'], vra_postgres_db['port'], vra_postgres_db['database'], vra_postgres_db['user'], vra_postgres_db['password'] )
-                if (vra_messaging is not None):
-                    status, message = vra.configure_messaging(vra_instance, vra_user, token, vra_messaging['host'], vra_messaging['port'], vra_messaging['user'], vra_messaging['password'] )
-                if (vra_cluster is not None):
-                    status, message = vra.configure_cluster(vra_instance, vra_user, token, vra_cluster['host'], vra_cluster['user'], vra_cluster['password'] )
-                if status:
-                    return False, "Postgres REST API Invoked  Successfully by " + vra_user+ "for " + vra_instance + " with Token:" + token + " Response received:" + message
-                else:
-                    return True, message
+                changed, diff, failures = vra.apply_config(vra_instance, vra_user, token,
+                                                           desired_settings(module), module.check_mode)
+                if failures:
+                    return True, dict(msg="Config page submit failed for " + ", ".join(sorted(failures)),
+                                      failures=failures, settings=diff)
+                msg = "Settings of " + vra_instance + (" updated" if changed else " unchanged")
+                unreadable = sorted(id for id, d in diff.items() if d.get('unreadable'))
+                if unreadable:
+                    msg += ", current values of " + ", ".join(unreadable) + " could not be read and were not applied"
+                return False, dict(changed=changed, settings=diff, unreadable=unreadable, msg=msg)
             else:
-                return True, vra_instance
+                return True, dict(msg=vra_instance)
+        else:
+            return True, dict(msg=vra_instance + " is not accessible")
     except Exception as a:
         return True, dict(msg=str(a))
 
@@ -292,12 +385,15 @@ def main():
             vra_postgres_db = dict(type='dict',required=False),
             vra_messaging = dict(type='dict',required=False),
             vra_cluster = dict(type='dict',required=False),
+            vra_settings = dict(type='dict',required=False),
             vra_instance = dict(type='str',required=True),
             vra_user = dict(type='str',required=False, default='root'),
             vra_item = dict(type='str',required=False, default='postgres'),
             vra_port = dict(type='int',required=False, default='5480'),
             vra_root_password = dict(type='str',required=True),
-        )
+            update_password = dict(type='str',required=False, default='on_change', choices=['always', 'on_change']),
+        ),
+        supports_check_mode=True
     )
 
     try:
@@ -306,10 +402,11 @@ def main():
         import traceback
         module.fail_json(msg = '%s: %s\n%s' %(e.__class__.__name__, str(e), traceback.format_exc()))
     if fail:
-        module.fail_json(msg=result)
+        module.fail_json(**result)
     else:
-        module.exit_json(changed=True, msg=result)
+        module.exit_json(**result)
 
 from ansible.module_utils.basic import *
 from ansible.module_utils.facts import *
+from ansible.module_utils.vami import vami_pool, parse_config_page, CONFIG_PAGE_READ_ACTIONS
 main()